@@ -1,37 +1,154 @@
-from passlib.hash import bcrypt
-from models import User
+from metrics import metrics
+from usernames import usernames
 import jwt
 import os
+import collections
 import datetime
+import secrets
+import threading
+import time
 
 SECRET_KEY = os.getenv("SECRET_KEY", "super-secret-key")
+# "jwt" (stateless, the default) or "session" (opaque IDs in an in-memory table)
+TOKEN_BACKEND = os.getenv("TOKEN_BACKEND", "jwt")
+# Lifetime of a login token, and most sessions kept by the session backend
+TOKEN_TTL_SECONDS = float(os.getenv("TOKEN_TTL_SECONDS", str(24 * 60 * 60)))
+TOKEN_MAX_SESSIONS = int(os.getenv("TOKEN_MAX_SESSIONS", "100000"))
+
+_bcrypt_lock = threading.Lock()
+
+def _bcrypt():
+    # passlib/bcrypt are only needed on signup and login, so keep them off the
+    # import path of every worker. passlib.hash resolves its handlers lazily
+    # and that is not thread-safe, so the first import happens under a lock.
+    with _bcrypt_lock:
+        from passlib.hash import bcrypt
+    return bcrypt
 
 def create_user(username: str, password: str, session):
-    if session.query(User).filter_by(username=username).first():
+    # Names this worker already knows are taken are refused without hashing
+    # or a query. Otherwise one INSERT that the unique index may turn into a
+    # no-op: no read first, and concurrent signups cannot race past a check.
+    if usernames.known_taken(username):
+        metrics.inc("signup.cache_rejected")
         return False
-    user = User(username=username, password_hash=bcrypt.hash(password))
-    session.add(user)
+    from sqlalchemy.dialects.sqlite import insert
+    from models import User
+
+    bcrypt = _bcrypt()
+    stmt = (
+        insert(User)
+        .values(username=username, password_hash=bcrypt.hash(password))
+        .on_conflict_do_nothing(index_elements=["username"])
+    )
+    created = session.execute(stmt).rowcount == 1
     session.commit()
-    return True
+    usernames.taken(username)
+    if not created:
+        metrics.inc("signup.conflicts")
+    return created
 
 def authenticate_user(username: str, password: str, session):
+    from models import User
+
+    bcrypt = _bcrypt()
     user = session.query(User).filter_by(username=username).first()
     if not user or not bcrypt.verify(password, user.password_hash):
         return None
-    return generate_token(username)  # Generate JWT token if authentication succeeds
+    return generate_token(username)  # Generate a token if authentication succeeds
+
+def is_admin(username: str) -> bool:
+    # ADMIN_USERS is a comma-separated list of usernames allowed to use the
+    # /admin endpoints. Read per call so a value from .env is picked up.
+    return username in {u.strip() for u in os.getenv("ADMIN_USERS", "").split(",") if u.strip()}
+
+class TokenBackend:
+    """Issues and checks login tokens. Pick one with TOKEN_BACKEND."""
+
+    name = "base"
+
+    def issue(self, username: str) -> str:
+        raise NotImplementedError
+
+    def verify(self, token: str):
+        """Return the token's username, or None if it is invalid or expired."""
+        raise NotImplementedError
+
+class JWTBackend(TokenBackend):
+    """
+    Stateless HS256 JWTs (the default): any worker sharing SECRET_KEY can
+    verify them. The key is encoded to bytes and the decode options built
+    once rather than on every call.
+    """
+
+    name = "jwt"
+
+    def __init__(self, secret: str = SECRET_KEY, ttl: float = TOKEN_TTL_SECONDS):
+        self._key = secret.encode()
+        self._ttl = datetime.timedelta(seconds=ttl)
+        self._algorithms = ["HS256"]
+
+    def issue(self, username: str) -> str:
+        payload = {
+            "username": username,
+            "exp": datetime.datetime.utcnow() + self._ttl
+        }
+        return jwt.encode(payload, self._key, algorithm="HS256")
+
+    def verify(self, token: str):
+        try:
+            payload = jwt.decode(token, self._key, algorithms=self._algorithms)
+            return payload.get("username")
+        except jwt.ExpiredSignatureError:
+            return None
+        except jwt.InvalidTokenError:
+            return None
+
+class SessionBackend(TokenBackend):
+    """
+    Opaque random session IDs looked up in an in-memory table. Verifying is
+    a dict lookup, but sessions only exist in the worker that issued them
+    and are lost on restart, so this suits a single worker or sticky
+    sessions. The oldest sessions are evicted past max_sessions.
+    """
+
+    name = "session"
+
+    def __init__(self, ttl: float = TOKEN_TTL_SECONDS, max_sessions: int = TOKEN_MAX_SESSIONS):
+        self._ttl = ttl
+        self._max_sessions = max_sessions
+        self._sessions = collections.OrderedDict()  # token -> (username, expires at)
+        self._lock = threading.Lock()
+
+    def issue(self, username: str) -> str:
+        token = secrets.token_urlsafe(32)
+        with self._lock:
+            self._sessions[token] = (username, time.monotonic() + self._ttl)
+            while len(self._sessions) > self._max_sessions:
+                self._sessions.popitem(last=False)
+        return token
+
+    def verify(self, token: str):
+        entry = self._sessions.get(token)
+        if entry is None:
+            return None
+        username, expires = entry
+        if time.monotonic() >= expires:
+            with self._lock:
+                self._sessions.pop(token, None)
+            return None
+        return username
+
+    def revoke(self, token: str):
+        with self._lock:
+            self._sessions.pop(token, None)
+
+TOKEN_BACKENDS = {"jwt": JWTBackend, "session": SessionBackend}
+
+token_backend = TOKEN_BACKENDS[TOKEN_BACKEND]()
 
 def generate_token(username: str):
-    payload = {
-        "username": username,
-        "exp": datetime.datetime.utcnow() + datetime.timedelta(days=1)
-    }
-    return jwt.encode(payload, SECRET_KEY, algorithm="HS256")
+    return token_backend.issue(username)
 
 def verify_token(token: str):
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
-        return payload.get("username")
-    except jwt.ExpiredSignatureError:
-        return None
-    except jwt.InvalidTokenError:
-        return None
\ No newline at end of file
+    return token_backend.verify(token)
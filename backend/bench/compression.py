@@ -0,0 +1,87 @@
+"""
+Benchmark for response compression.
+
+Builds NDJSON history exports and JSON reply bodies of several sizes and,
+for every installed encoding (gzip always, zstd and brotli if available),
+reports the bytes saved and the CPU time spent compressing, both as a
+whole body and as a stream flushed every line-batch the way
+CompressionMiddleware sends /history/export.
+
+Usage (from backend/):
+    python bench/compression.py --sizes 1000 10000 100000 1000000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from compression import ENCODINGS  # noqa: E402
+
+WORDS = (
+    "merch shirt print ink screen design band tour poster gig venue lights "
+    "sound stage collab artist mural sketch palette canvas studio release "
+    "album cover logo brand zine drop launch community event festival idea"
+).split()
+
+
+def ndjson_body(size: int, seed: int = 0) -> list:
+    """NDJSON lines of chat messages totalling at least size bytes."""
+    rng = random.Random(seed)
+    lines, total, i = [], 0, 0
+    while total < size:
+        line = json.dumps({
+            "id": i,
+            "role": "user" if i % 2 == 0 else "assistant",
+            "content": " ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 80))),
+            "created_at": "2025-05-01T12:00:00.000000+00:00",
+        }) + "\n"
+        lines.append(line.encode())
+        total += len(line)
+        i += 1
+    return lines
+
+
+def timed(fn, rounds: int):
+    start = time.process_time()
+    for _ in range(rounds):
+        out = fn()
+    return out, (time.process_time() - start) / rounds * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000, 1000000])
+    parser.add_argument("--lines-per-chunk", type=int, default=50, help="lines per streamed chunk")
+    args = parser.parse_args()
+
+    print(f"{'size':>9} {'enc':>5} {'mode':>7} {'out':>9} {'saved':>7} {'cpu ms':>8} {'MB/s':>7}")
+    for size in args.sizes:
+        lines = ndjson_body(size)
+        body = b"".join(lines)
+        chunks = [b"".join(lines[i:i + args.lines_per_chunk]) for i in range(0, len(lines), args.lines_per_chunk)]
+        rounds = max(3, 2_000_000 // len(body))
+
+        for name, codec in ENCODINGS.items():
+            def whole():
+                c = codec()
+                return c.compress(body) + c.finish()
+
+            def stream():
+                c = codec()
+                out = [c.compress(chunk) + c.flush() for chunk in chunks[:-1]]
+                out.append(c.compress(chunks[-1]) + c.finish())
+                return b"".join(out)
+
+            for mode, fn in (("whole", whole), ("stream", stream)):
+                out, cpu_ms = timed(fn, rounds)
+                saved = 1 - len(out) / len(body)
+                speed = len(body) / 1e6 / (cpu_ms / 1000) if cpu_ms else float("inf")
+                print(f"{len(body):>9} {name:>5} {mode:>7} {len(out):>9} {saved:>6.0%} {cpu_ms:>8.3f} {speed:>7.0f}")
+
+
+if __name__ == "__main__":
+    main()
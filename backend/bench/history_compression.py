@@ -0,0 +1,84 @@
+"""
+Benchmark for the compressed cold tier of HistoryStore.
+
+Fills a store with synthetic conversations, compacts them all, and reports
+heap usage before and after, the compression ratio, and the latency of
+decompressing a conversation on the user's next message.
+
+Usage (from backend/):
+    python bench/history_compression.py --users 5000 --turns 8
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from history import HistoryStore  # noqa: E402
+from messages import Message, SYSTEM, USER, ASSISTANT  # noqa: E402
+
+WORDS = (
+    "merch shirt print ink screen design band tour poster gig venue lights "
+    "sound stage collab artist mural sketch palette canvas studio release "
+    "album cover logo brand zine drop launch community event festival idea "
+    "color texture vibe audience budget schedule supplier fabric eco friendly"
+).split()
+
+
+def sentence(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def fill(store: HistoryStore, system_prompt: Message, users: int, turns: int, seed: int = 0):
+    rng = random.Random(seed)
+    for u in range(users):
+        history = [system_prompt]
+        for _ in range(turns):
+            history.append(Message(USER, sentence(rng, rng.randint(8, 30))))
+            history.append(Message(ASSISTANT, " ".join(sentence(rng, 15) for _ in range(rng.randint(3, 8)))))
+        store.set(f"user{u}", history)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--turns", type=int, default=8)
+    parser.add_argument("--samples", type=int, default=500, help="conversations to decompress for latency")
+    args = parser.parse_args()
+
+    system_prompt = Message(SYSTEM, "You are MuseMate, an AI creative assistant.")
+    store = HistoryStore(idle_seconds=0, shared=[system_prompt])
+
+    tracemalloc.start()
+    fill(store, system_prompt, args.users, args.turns)
+    hot_bytes = tracemalloc.get_traced_memory()[0]
+
+    start = time.perf_counter()
+    store.compact(now=time.monotonic() + 1)
+    compact_s = time.perf_counter() - start
+    cold_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    stats = store.stats()
+    latencies = []
+    for u in random.Random(1).sample(range(args.users), min(args.samples, args.users)):
+        start = time.perf_counter()
+        store.get(f"user{u}")
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+
+    print(f"{args.users} conversations x {args.turns} turns, codec {stats['codec']}")
+    print(f"  heap hot:            {hot_bytes / 1e6:8.1f} MB")
+    print(f"  heap after compact:  {cold_bytes / 1e6:8.1f} MB ({hot_bytes / cold_bytes:.1f}x smaller)")
+    print(f"  compression ratio:   {stats['compression_ratio']:8.2f}")
+    print(f"  compact time:        {compact_s * 1000 / args.users:8.3f} ms/conversation")
+    print(f"  decompress p50:      {statistics.median(latencies):8.3f} ms")
+    print(f"  decompress p99:      {latencies[int(len(latencies) * 0.99) - 1]:8.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Memory benchmark for in-memory conversation histories.
+
+Builds the same synthetic conversations twice, once with the old
+{"role": ..., "content": ...} dict per message and a system prompt string
+per user, and once with slotted Message objects sharing one SYSTEM_PROMPT,
+and reports the bytes allocated per conversation for each.
+
+Usage (from backend/):
+    python bench/history_memory.py --users 10000 --turns 6
+"""
+import argparse
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from messages import Message, SYSTEM, USER, ASSISTANT  # noqa: E402
+
+PROMPT_TEXT = (
+    "You are MuseMate, an AI creative assistant. Follow these rules:\n"
+    "1. When users need creative services, suggest relevant businesses.\n"
+    "2. Use special tags to recommend services:\n"
+    "   - For screen printing: [LINK:screen_printing]\n"
+    "   - For creative hub services: [LINK:creative_hub]\n"
+    "3. Example: 'If you need help with merchandise or printing check out, [LINK:screen_printing]'\n"
+    "4. Be natural in your suggestions, don't force them.\n"
+    "5. Always be helpful and encouraging.\n"
+    "6. Have a divinely guided intention!\n"
+    "7. Be a good friend to the user and help them with their creative needs."
+)
+
+
+def make_turns(users: int, turns: int):
+    """Pre-build message texts so both variants allocate only the history structures."""
+    return [
+        [(f"user {u} question {t} about merch and gigs", f"assistant {u} answer {t} " * 8) for t in range(turns)]
+        for u in range(users)
+    ]
+
+
+def build_dicts(texts):
+    histories = {}
+    for u, turns in enumerate(texts):
+        # The old code built the prompt per user; copy it to model the
+        # worst case where the text is not a shared compile-time constant
+        history = [{"role": "system", "content": "".join([PROMPT_TEXT[:1], PROMPT_TEXT[1:]])}]
+        for question, answer in turns:
+            history.append({"role": "user", "content": question})
+            history.append({"role": "assistant", "content": answer})
+        histories[f"user{u}"] = history
+    return histories
+
+
+def build_messages(texts):
+    system_prompt = Message(SYSTEM, PROMPT_TEXT)
+    histories = {}
+    for u, turns in enumerate(texts):
+        history = [system_prompt]
+        for question, answer in turns:
+            history.append(Message(USER, question))
+            history.append(Message(ASSISTANT, answer))
+        histories[f"user{u}"] = history
+    return histories
+
+
+def measure(builder, texts) -> int:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    histories = builder(texts)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del histories
+    return after - before
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--turns", type=int, default=6, help="user/assistant exchanges per conversation")
+    args = parser.parse_args()
+
+    texts = make_turns(args.users, args.turns)
+    dict_bytes = measure(build_dicts, texts)
+    message_bytes = measure(build_messages, texts)
+
+    print(f"{args.users} conversations x {args.turns} turns (message text excluded)")
+    print(f"  dict messages:    {dict_bytes / args.users:8.0f} bytes/conversation")
+    print(f"  Message objects:  {message_bytes / args.users:8.0f} bytes/conversation")
+    print(f"  saved:            {1 - message_bytes / dict_bytes:8.1%}")
+
+
+if __name__ == "__main__":
+    main()
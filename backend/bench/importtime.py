@@ -0,0 +1,102 @@
+"""
+Import-time benchmark for MuseMate cold starts.
+
+Runs `python -X importtime -c "import musemate"` in fresh interpreters and
+reports the cumulative import time plus the slowest modules. Save a result
+with --save and compare later runs against it with --baseline to catch
+cold-start regressions.
+
+Usage (from backend/):
+    python bench/importtime.py
+    python bench/importtime.py --save bench/importtime_baseline.json
+    python bench/importtime.py --baseline bench/importtime_baseline.json --max-regression 0.25
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_once(module: str) -> dict:
+    """Import module in a fresh interpreter and return {package: (self_us, cumulative_us)}."""
+    env = dict(os.environ)
+    # create_app() refuses to start without a key; any value works for an import
+    env.setdefault("LLAMA_API_KEY", "importtime-benchmark")
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=BACKEND_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        raise SystemExit(f"import {module} failed:\n{proc.stderr[-2000:]}")
+
+    timings = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        timings[name.strip()] = (int(self_us), int(cumulative_us))
+    return timings
+
+
+def measure(module: str, runs: int, top: int) -> dict:
+    samples = [run_once(module) for _ in range(runs)]
+    totals = [s[module][1] for s in samples]
+
+    # Rank modules by median cumulative time across runs
+    names = set().union(*samples)
+    medians = {
+        name: statistics.median(s[name][1] for s in samples if name in s)
+        for name in names
+    }
+    slowest = sorted(medians.items(), key=lambda item: item[1], reverse=True)[:top]
+
+    return {
+        "module": module,
+        "runs": runs,
+        "total_ms": statistics.median(totals) / 1000,
+        "min_ms": min(totals) / 1000,
+        "max_ms": max(totals) / 1000,
+        "slowest": [{"module": name, "cumulative_ms": us / 1000} for name, us in slowest],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="musemate")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--save", help="write the result as JSON to this path")
+    parser.add_argument("--baseline", help="compare against a result saved with --save")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="fail if total import time grows by more than this fraction of the baseline")
+    args = parser.parse_args()
+
+    result = measure(args.module, args.runs, args.top)
+
+    print(f"import {result['module']}: {result['total_ms']:.1f} ms median "
+          f"(min {result['min_ms']:.1f}, max {result['max_ms']:.1f}, {result['runs']} runs)")
+    for entry in result["slowest"]:
+        print(f"  {entry['cumulative_ms']:8.1f} ms  {entry['module']}")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(result, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        change = (result["total_ms"] - baseline["total_ms"]) / baseline["total_ms"]
+        print(f"baseline {baseline['total_ms']:.1f} ms -> {result['total_ms']:.1f} ms ({change:+.1%})")
+        if change > args.max_regression:
+            sys.exit(f"import time regressed by {change:.1%} (limit {args.max_regression:.0%})")
+
+
+if __name__ == "__main__":
+    main()
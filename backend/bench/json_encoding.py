@@ -0,0 +1,84 @@
+"""
+Benchmark for the JSON layer on the /chat path.
+
+Encodes the upstream request body for synthetic histories the old way
+(stdlib json over a list of message dicts, as requests' json= did) and
+with MessageEncoder (the serializer in use, with the system prompt
+encoded once), then decodes a typical response body with each.
+
+Usage (from backend/):
+    python bench/json_encoding.py --turns 20 --rounds 2000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from catalog import Catalog  # noqa: E402
+from messages import Message, USER, ASSISTANT  # noqa: E402
+from serialization import JSON_BACKEND, MessageEncoder, loads  # noqa: E402
+from upstream import LLAMA_MODEL  # noqa: E402
+
+WORDS = (
+    "merch shirt print ink screen design band tour poster gig venue lights "
+    "sound stage collab artist mural sketch palette canvas studio release "
+    "album cover logo brand zine drop launch community event festival idea"
+).split()
+
+
+def sentence(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def per_call_us(fn, rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    return (time.perf_counter() - start) / rounds * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--rounds", type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    catalog = Catalog.load()
+    history = [catalog.system_prompt]
+    for _ in range(args.turns):
+        history.append(Message(USER, sentence(rng, rng.randint(8, 30))))
+        history.append(Message(ASSISTANT, " ".join(sentence(rng, 15) for _ in range(rng.randint(3, 8)))))
+
+    encoder = MessageEncoder()
+    for message in catalog.shared_messages():
+        encoder.pin(message)
+
+    body = encoder.chat_body(LLAMA_MODEL, history)
+    assert json.loads(body) == {"model": LLAMA_MODEL, "messages": [m.to_dict() for m in history]}
+
+    response = json.dumps({
+        "completion_message": {"content": {"text": history[-1].content}},
+        "metrics": [{"metric": "num_prompt_tokens", "value": 900}, {"metric": "num_completion_tokens", "value": 120}],
+    }).encode()
+
+    stdlib_encode = per_call_us(
+        lambda: json.dumps({"model": LLAMA_MODEL, "messages": [m.to_dict() for m in history]}).encode(), args.rounds
+    )
+    fast_encode = per_call_us(lambda: encoder.chat_body(LLAMA_MODEL, history), args.rounds)
+    stdlib_decode = per_call_us(lambda: json.loads(response), args.rounds)
+    fast_decode = per_call_us(lambda: loads(response), args.rounds)
+
+    print(f"{len(history)} messages, {len(body)} byte request body, backend {JSON_BACKEND}")
+    print(f"  encode stdlib:   {stdlib_encode:8.1f} us")
+    print(f"  encode {JSON_BACKEND:8s} {fast_encode:8.1f} us ({stdlib_encode / fast_encode:.1f}x)")
+    print(f"  decode stdlib:   {stdlib_decode:8.1f} us")
+    print(f"  decode {JSON_BACKEND:8s} {fast_decode:8.1f} us ({stdlib_decode / fast_decode:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
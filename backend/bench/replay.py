@@ -0,0 +1,331 @@
+"""
+Replay recorded /chat traffic against a MuseMate build and compare builds.
+
+Record traffic by starting a worker with TRAFFIC_RECORD_PATH set (see
+traffic.py). Replaying starts a mock Llama API and a uvicorn worker for
+the given backend directory with a fresh database, recreates each
+recorded user's history length, then sends every recorded chat at its
+recorded arrival time. The mock answers each chat after the recorded
+upstream time with a reply of the recorded size, so what differs between
+builds is MuseMate's own overhead. Chats that failed when recorded
+(rate limited, upstream errors) are not replayed; the report counts them
+by status. Results are saved as JSON; compare two of them to catch
+regressions before a release.
+
+Usage (from backend/):
+    python bench/replay.py run traffic.ndjson --backend . --label main --out main.json
+    python bench/replay.py run traffic.ndjson --backend ../../candidate/backend --out candidate.json
+    python bench/replay.py compare main.json candidate.json --threshold 0.10
+"""
+import argparse
+import json
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import requests
+
+# Marker in each replayed prompt telling the mock how to answer: ⟦upstream_ms,reply_chars⟧
+MARKER = re.compile(r"⟦(\d+(?:\.\d+)?),(\d+)⟧")
+FILLER = "lorem ipsum merch print poster gig mural studio "
+
+
+def load_recording(paths) -> list:
+    """
+    Read one or more recordings (one per worker) into a single list of
+    event dicts, ordered by wall-clock arrival time.
+    """
+    events = []
+    for path in paths:
+        fields, started = None, 0.0
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                item = json.loads(line)
+                if isinstance(item, dict):
+                    fields, started = item["fields"], item["started"]
+                    continue
+                event = dict(zip(fields, item))
+                event["at"] = started + event["t"]
+                events.append(event)
+    events.sort(key=lambda e: e["at"])
+    if events:
+        first = events[0]["at"]
+        for event in events:
+            event["at"] -= first
+    return events
+
+
+def prompt_for(prompt_chars: int, upstream_ms: float, reply_chars: int) -> str:
+    marker = f"⟦{upstream_ms:.0f},{reply_chars}⟧ "
+    fill = max(0, prompt_chars - len(marker))
+    return marker + (FILLER * (fill // len(FILLER) + 1))[:fill]
+
+
+class _MockLlama(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        upstream_ms, reply_chars = 0.0, 20
+        for message in reversed(body["messages"]):
+            match = MARKER.search(message["content"]) if message["role"] == "user" else None
+            if match:
+                upstream_ms, reply_chars = float(match.group(1)), int(match.group(2))
+                break
+        time.sleep(upstream_ms / 1000)
+        text = (FILLER * (reply_chars // len(FILLER) + 1))[:max(reply_chars, 1)]
+        out = json.dumps({"completion_message": {"content": {"text": text}}}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(out)))
+        self.end_headers()
+        self.wfile.write(out)
+
+
+def start_mock(port: int = 0):
+    server = ThreadingHTTPServer(("127.0.0.1", port), _MockLlama)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_worker(backend: str, mock_url: str, workdir: str):
+    port = free_port()
+    env = {
+        **os.environ,
+        "PYTHONPATH": os.path.abspath(backend),
+        "LLAMA_API_KEY": "replay",
+        "LLAMA_API_URL": mock_url,
+        "RATE_LIMIT_ENABLED": "false",
+        "DAILY_TOKEN_BUDGET": str(10 ** 12),
+        # /metrics is admin only
+        "ADMIN_USERS": "replay-admin",
+    }
+    env.pop("TRAFFIC_RECORD_PATH", None)
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "musemate:app", "--port", str(port), "--log-level", "warning"],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"worker exited with code {proc.returncode}")
+        try:
+            requests.get(url + "/", timeout=1)
+            return proc, url
+        except requests.RequestException:
+            time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError("worker did not start within 60s")
+
+
+def percentile(values, p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def replay(events, url: str, speed: float, concurrency: int) -> dict:
+    session = requests.Session()
+    session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=concurrency))
+    users = sorted({e["user"] for e in events})
+
+    def login(user):
+        name = f"replay-{user}"
+        session.post(url + "/signup", json={"username": name, "password": "replay"})
+        token = session.post(url + "/login", json={"username": name, "password": "replay"}).json()["token"]
+        return user, {"Authorization": f"Bearer {token}"}
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        headers = dict(pool.map(login, users))
+
+        # Recreate the history each user had when recording started: every
+        # turn adds a user and an assistant message after the system prompt
+        first = {}
+        for event in events:
+            first.setdefault(event["user"], event)
+        warmups = [
+            (user, i) for user, event in first.items()
+            for i in range(max(0, (event["history_messages"] - 2) // 2))
+        ]
+        list(pool.map(lambda w: session.post(url + "/chat", json={"content": prompt_for(40, 0, 40)},
+                                             headers=headers[w[0]]), warmups))
+
+        results = []
+
+        def send(event):
+            started = time.perf_counter()
+            try:
+                response = session.post(
+                    url + "/chat",
+                    json={"content": prompt_for(event["prompt_chars"], event["upstream_ms"], event["reply_chars"])},
+                    headers=headers[event["user"]],
+                )
+                status = response.status_code
+            except requests.RequestException:
+                status = 0
+            latency = (time.perf_counter() - started) * 1000
+            results.append((status, latency, latency - event["upstream_ms"]))
+
+        began = time.perf_counter()
+        futures = []
+        for event in events:
+            delay = event["at"] / speed - (time.perf_counter() - began)
+            if delay > 0:
+                time.sleep(delay)
+            futures.append(pool.submit(send, event))
+        for future in futures:
+            future.result()
+        duration = time.perf_counter() - began
+
+    _, admin = login("admin")
+    metrics = session.get(url + "/metrics", headers=admin).json()
+    ok = [r for r in results if r[0] == 200]
+    latencies = [r[1] for r in ok]
+    overheads = [r[2] for r in ok]
+    errors = {}
+    for status, _, _ in results:
+        if status != 200:
+            errors[str(status)] = errors.get(str(status), 0) + 1
+    return {
+        "requests": len(results),
+        "warmup_requests": len(warmups),
+        "error_rate": round(1 - len(ok) / len(results), 4) if results else 0.0,
+        "errors": errors,
+        "duration_s": round(duration, 2),
+        "throughput_rps": round(len(results) / duration, 2) if duration else 0.0,
+        "latency_p50_ms": round(percentile(latencies, 50), 1),
+        "latency_p90_ms": round(percentile(latencies, 90), 1),
+        "latency_p99_ms": round(percentile(latencies, 99), 1),
+        "latency_max_ms": round(max(latencies, default=0.0), 1),
+        "overhead_p50_ms": round(percentile(overheads, 50), 1),
+        "overhead_p99_ms": round(percentile(overheads, 99), 1),
+        "overhead_mean_ms": round(statistics.fmean(overheads), 1) if overheads else 0.0,
+        "loop_max_lag_ms": metrics.get("event_loop", {}).get("max_lag_ms"),
+    }
+
+
+def run(args):
+    events = load_recording(args.recording)
+    if args.limit:
+        events = events[:args.limit]
+    # A recorded 429 or 500 never got a normal answer, so replaying it as a
+    # successful chat would score a different workload
+    recorded_errors = {}
+    for event in events:
+        if event["status"] != 200:
+            recorded_errors[str(event["status"])] = recorded_errors.get(str(event["status"]), 0) + 1
+    events = [e for e in events if e["status"] == 200]
+    if not events:
+        sys.exit("recording has no successful chats")
+    mock, mock_url = start_mock(args.mock_port)
+    with tempfile.TemporaryDirectory() as workdir:
+        if args.url:
+            url, proc = args.url, None
+            print(f"Mock Llama API at {mock_url}; the target worker must use LLAMA_API_URL={mock_url}")
+        else:
+            proc, url = start_worker(args.backend, mock_url, workdir)
+        try:
+            report = replay(events, url, args.speed, args.concurrency)
+        finally:
+            if proc is not None:
+                proc.terminate()
+                proc.wait(timeout=30)
+            mock.shutdown()
+    report = {
+        "label": args.label or os.path.abspath(args.backend or args.url),
+        "speed": args.speed,
+        "recorded_errors_skipped": recorded_errors,
+        **report,
+    }
+    print(json.dumps(report, indent=2))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+# Metrics where a higher value in the candidate is a regression
+LOWER_IS_BETTER = [
+    "error_rate", "latency_p50_ms", "latency_p90_ms", "latency_p99_ms", "latency_max_ms",
+    "overhead_p50_ms", "overhead_p99_ms", "overhead_mean_ms", "loop_max_lag_ms",
+]
+
+
+def compare(args):
+    with open(args.baseline, encoding="utf-8") as f:
+        base = json.load(f)
+    with open(args.candidate, encoding="utf-8") as f:
+        cand = json.load(f)
+    print(f"{'metric':<20} {base['label'][-18:]:>18} {cand['label'][-18:]:>18} {'change':>9}")
+    regressions = []
+    for key in ["requests", "throughput_rps", *LOWER_IS_BETTER]:
+        a, b = base.get(key), cand.get(key)
+        if a is None or b is None:
+            continue
+        change = (b - a) / a if a else (0.0 if b == a else float("inf"))
+        flag = ""
+        # Ignore sub-millisecond noise on tiny overheads
+        if key in LOWER_IS_BETTER and change > args.threshold and b - a > args.min_delta:
+            flag = "  REGRESSION"
+            regressions.append(key)
+        print(f"{key:<20} {a:>18} {b:>18} {change:>+8.1%}{flag}")
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) over {args.threshold:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+    print("\nNo regressions")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = sub.add_parser("run", help="replay a recording against one build")
+    run_parser.add_argument("recording", nargs="+", help="recorded traffic file(s)")
+    run_parser.add_argument("--backend", default=".", help="backend directory of the build to start")
+    run_parser.add_argument("--url", help="replay against an already running worker instead")
+    run_parser.add_argument("--mock-port", type=int, default=0, help="port for the mock Llama API")
+    run_parser.add_argument("--speed", type=float, default=1.0, help="replay this many times faster")
+    run_parser.add_argument("--concurrency", type=int, default=128, help="client threads")
+    run_parser.add_argument("--limit", type=int, help="replay only the first N chats")
+    run_parser.add_argument("--label", help="name of the build in reports")
+    run_parser.add_argument("--out", help="write the report JSON here")
+
+    compare_parser = sub.add_parser("compare", help="compare two replay reports")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("candidate")
+    compare_parser.add_argument("--threshold", type=float, default=0.10, help="relative change flagged as regression")
+    compare_parser.add_argument("--min-delta", type=float, default=1.0, help="ignore absolute changes below this")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        run(args)
+    else:
+        compare(args)
+
+
+if __name__ == "__main__":
+    main()
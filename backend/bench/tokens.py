@@ -0,0 +1,68 @@
+"""
+Microbenchmark for login token backends.
+
+Measures issue and verify throughput of every backend in auth.TOKEN_BACKENDS
+(HS256 JWT and opaque in-memory sessions), plus the previous JWT code path
+that passed the secret as a str on every call.
+
+Usage (from backend/):
+    python bench/tokens.py --rounds 20000
+"""
+import argparse
+import datetime
+import os
+import sys
+import time
+import warnings
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import jwt  # noqa: E402
+
+from auth import SECRET_KEY, TOKEN_BACKENDS  # noqa: E402
+
+# The default development key is short; keep PyJWT's warning out of the numbers
+warnings.simplefilter("ignore")
+
+
+class _LegacyJWT:
+    """generate_token/verify_token as they were before token backends."""
+
+    def issue(self, username: str) -> str:
+        payload = {"username": username, "exp": datetime.datetime.utcnow() + datetime.timedelta(days=1)}
+        return jwt.encode(payload, SECRET_KEY, algorithm="HS256")
+
+    def verify(self, token: str):
+        try:
+            return jwt.decode(token, SECRET_KEY, algorithms=["HS256"]).get("username")
+        except jwt.InvalidTokenError:
+            return None
+
+
+def per_second(fn, items) -> float:
+    start = time.perf_counter()
+    for item in items:
+        fn(item)
+    return len(items) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=20000)
+    parser.add_argument("--users", type=int, default=1000)
+    args = parser.parse_args()
+
+    names = [f"user{i % args.users}" for i in range(args.rounds)]
+    backends = {"jwt (before)": _LegacyJWT(), **{name: cls() for name, cls in TOKEN_BACKENDS.items()}}
+
+    print(f"{'backend':<14} {'issue/s':>10} {'verify/s':>10} {'token bytes':>12}")
+    for name, backend in backends.items():
+        issue_rate = per_second(backend.issue, names)
+        tokens = [backend.issue(n) for n in names]
+        assert backend.verify(tokens[0]) == names[0]
+        verify_rate = per_second(backend.verify, tokens)
+        print(f"{name:<14} {issue_rate:>10.0f} {verify_rate:>10.0f} {len(tokens[0]):>12}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+import asyncio
+import json
+import logging
+import os
+import re
+
+from messages import Message, SYSTEM
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Business catalog file. Each service has:
+# - name: Display name of the business
+# - url: Website link
+# - description: Short business description
+# - keywords: List of words that trigger service suggestions
+# - prompt_label: How the system prompt refers to the service
+BUSINESS_CATALOG_PATH = os.getenv(
+    "BUSINESS_CATALOG_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "catalog.json")
+)
+# Seconds between checks of the catalog file for changes
+CATALOG_POLL_INTERVAL = float(os.getenv("CATALOG_POLL_INTERVAL", "5"))
+
+
+class Catalog:
+    """
+    Business catalog compiled for the /chat path.
+
+    Everything derived from the raw service data is built once here: the
+    system prompt, the keyword hint messages, one regex that finds every
+    keyword in a message, the rendered business cards and one regex that
+    replaces all [LINK:...] tags in a reply. Instances are never modified
+    after construction, so a request can keep using the catalog it started
+    with while a reload swaps in a new one.
+    """
+
+    def __init__(self, services: dict, prompt_example: str = "", version: float = 0):
+        self.services = services
+        self.version = version
+
+        tag_lines = "".join(
+            f"   - For {info.get('prompt_label', service_id)}: [LINK:{service_id}]\n"
+            for service_id, info in services.items()
+        )
+        example = prompt_example or (f"check out [LINK:{next(iter(services))}]" if services else "")
+        self.system_prompt = Message(
+            SYSTEM,
+            "You are MuseMate, an AI creative assistant. Follow these rules:\n"
+            "1. When users need creative services, suggest relevant businesses.\n"
+            "2. Use special tags to recommend services:\n"
+            f"{tag_lines}"
+            f"3. Example: '{example}'\n"
+            "4. Be natural in your suggestions, don't force them.\n"
+            "5. Always be helpful and encouraging.\n"
+            "6. Have a divinely guided intention!\n"
+            "7. Be a good friend to the user and help them with their creative needs."
+        )
+        self.hints = {
+            service_id: Message(
+                SYSTEM,
+                f"User mentioned keywords related to {service_id}. Consider suggesting [LINK:{service_id}]"
+            )
+            for service_id in services
+        }
+        self.cards = {
+            service_id: (
+                f"\n\n🔗 Connect with {info['name']}\n"
+                f"💼 {info['description']}\n"
+                f"🌐 Visit: {info['url']}\n"
+            )
+            for service_id, info in services.items()
+        }
+
+        # Keyword -> services. A keyword also carries the services of every
+        # keyword that is a prefix of it: the regex reports the longest
+        # keyword at each position, and the shorter ones match there too.
+        owners = {}
+        for service_id, info in services.items():
+            for keyword in info["keywords"]:
+                owners.setdefault(keyword.lower(), set()).add(service_id)
+        self._keyword_services = {
+            keyword: frozenset().union(*(ids for other, ids in owners.items() if keyword.startswith(other)))
+            for keyword in owners
+        }
+        order = {service_id: i for i, service_id in enumerate(services)}
+        self._order = order
+        if owners:
+            alternatives = "|".join(re.escape(k) for k in sorted(owners, key=len, reverse=True))
+            # Lookahead so overlapping keywords are all found
+            self._keyword_re = re.compile(f"(?=({alternatives}))")
+        else:
+            self._keyword_re = None
+        self._tag_re = re.compile(
+            r"\[LINK:(" + "|".join(re.escape(s) for s in services) + r")\]"
+        ) if services else None
+
+    @classmethod
+    def load(cls, path: str = BUSINESS_CATALOG_PATH) -> "Catalog":
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        services = data["services"]
+        for service_id, info in services.items():
+            missing = {"name", "url", "description", "keywords"} - info.keys()
+            if missing:
+                raise ValueError(f"catalog service {service_id!r} is missing {sorted(missing)}")
+        return cls(services, data.get("prompt_example", ""), version=os.path.getmtime(path))
+
+    def shared_messages(self):
+        """Messages referenced by many histories (for HistoryStore.share)."""
+        return [self.system_prompt, *self.hints.values()]
+
+    def match_services(self, message: str) -> list:
+        """Service ids whose keywords appear in the message, in catalog order."""
+        if self._keyword_re is None:
+            return []
+        found = set()
+        for match in self._keyword_re.finditer(message.lower()):
+            found |= self._keyword_services[match.group(1)]
+        return sorted(found, key=self._order.__getitem__)
+
+    def render_links(self, reply: str) -> str:
+        """Replace [LINK:service_id] tags with the pre-rendered business cards."""
+        if self._tag_re is None or "[LINK:" not in reply:
+            return reply
+        return self._tag_re.sub(lambda m: self.cards[m.group(1)], reply)
+
+
+class CatalogSource:
+    """
+    Holds the current Catalog and hot-reloads it when the file changes.
+
+    A reload loads and compiles the new catalog off the event loop, then
+    back on the loop calls on_reload(new, previous) and replaces
+    self.current in a single assignment; a broken file is logged and the
+    previous catalog stays active.
+    """
+
+    def __init__(self, path: str = BUSINESS_CATALOG_PATH, on_reload=None):
+        self.path = path
+        self.on_reload = on_reload
+        self.current = Catalog.load(path)
+        self._seen = self.current.version
+
+    def _changed(self):
+        """Load the file if it changed since the last check, else return None. Safe to run off the event loop."""
+        mtime = os.path.getmtime(self.path)
+        if mtime == self._seen:
+            return None
+        # Set first so a broken file is reported once, not on every poll
+        self._seen = mtime
+        return Catalog.load(self.path)
+
+    def _swap(self, catalog: Catalog):
+        if self.on_reload is not None:
+            self.on_reload(catalog, self.current)
+        self.current = catalog
+        metrics.inc("catalog.reloads")
+        logger.info("Business catalog reloaded with %d services", len(catalog.services))
+
+    def reload(self) -> bool:
+        """Reload if the file changed. Returns True if a new catalog was swapped in."""
+        catalog = self._changed()
+        if catalog is None:
+            return False
+        self._swap(catalog)
+        return True
+
+    async def watch(self, interval: float = CATALOG_POLL_INTERVAL):
+        """Background loop polling the catalog file for changes."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                catalog = await asyncio.to_thread(self._changed)
+                if catalog is not None:
+                    # On the loop: on_reload updates state that request handlers read
+                    self._swap(catalog)
+            except Exception as e:
+                metrics.inc("catalog.reload_errors")
+                logger.warning("Business catalog reload failed, keeping the previous one: %s", e)
@@ -0,0 +1,181 @@
+import os
+import zlib
+
+from metrics import metrics
+
+try:
+    import zstandard
+except ImportError:  # optional
+    zstandard = None
+
+try:
+    import brotli
+except ImportError:  # optional
+    brotli = None
+
+# Set to "0" to serve every response uncompressed
+COMPRESSION_ENABLED = os.getenv("COMPRESSION_ENABLED", "1") != "0"
+# Complete responses smaller than this (bytes) are not worth compressing
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+# Levels chosen for speed: these run on the event loop for every large response
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "5"))
+COMPRESSION_ZSTD_LEVEL = int(os.getenv("COMPRESSION_ZSTD_LEVEL", "3"))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))
+
+COMPRESSIBLE_TYPES = (
+    "text/",
+    "application/json",
+    "application/x-ndjson",
+    "application/javascript",
+    "application/xml",
+)
+
+
+class _Gzip:
+    def __init__(self):
+        self._z = zlib.compressobj(COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._z.compress(data)
+
+    def flush(self) -> bytes:
+        # Sync flush: everything so far becomes decodable by the client
+        return self._z.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._z.flush()
+
+
+class _Zstd:
+    def __init__(self):
+        self._z = zstandard.ZstdCompressor(level=COMPRESSION_ZSTD_LEVEL).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._z.compress(data)
+
+    def flush(self) -> bytes:
+        return self._z.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self) -> bytes:
+        return self._z.flush()
+
+
+class _Brotli:
+    def __init__(self):
+        self._z = brotli.Compressor(quality=COMPRESSION_BROTLI_QUALITY)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._z.process(data)
+
+    def flush(self) -> bytes:
+        return self._z.flush()
+
+    def finish(self) -> bytes:
+        return self._z.finish()
+
+
+# Encodings in order of preference, among those installed
+ENCODINGS = {}
+if zstandard is not None:
+    ENCODINGS["zstd"] = _Zstd
+if brotli is not None:
+    ENCODINGS["br"] = _Brotli
+ENCODINGS["gzip"] = _Gzip
+
+
+def choose_encoding(accept_encoding: str):
+    """Pick the preferred available encoding the client accepts, or None."""
+    accepted, refused = set(), set()
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        q = params.strip()
+        try:
+            weight = float(q[2:]) if q.startswith("q=") else 1.0
+        except ValueError:
+            continue
+        (accepted if weight > 0 else refused).add(name.strip())
+    for name in ENCODINGS:
+        if name in accepted or ("*" in accepted and name not in refused):
+            return name
+    return None
+
+
+class CompressionMiddleware:
+    """
+    ASGI middleware compressing responses the client accepts compressed.
+
+    A complete response (a single body message) is compressed in one go if
+    it is at least min_size bytes. A streaming response (NDJSON exports,
+    /chat/batch, SSE) is compressed chunk by chunk and flushed after every
+    chunk, so each line reaches the client as soon as the app sends it.
+    Responses that already have a Content-Encoding, or whose type is not
+    text-like, pass through untouched.
+    """
+
+    def __init__(self, app, min_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.min_size = min_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not COMPRESSION_ENABLED:
+            return await self.app(scope, receive, send)
+        accept = ""
+        for name, value in scope.get("headers", ()):
+            if name == b"accept-encoding":
+                accept = value.decode("latin-1")
+                break
+        encoding = choose_encoding(accept) if accept else None
+        if encoding is None:
+            return await self.app(scope, receive, send)
+
+        start = None
+        compressor = None
+        passthrough = False
+
+        async def send_compressed(message):
+            nonlocal start, compressor, passthrough
+            if message["type"] == "http.response.start":
+                headers = {k.lower(): v for k, v in message.get("headers", ())}
+                content_type = headers.get(b"content-type", b"").decode("latin-1")
+                if b"content-encoding" in headers or not content_type.startswith(COMPRESSIBLE_TYPES):
+                    passthrough = True
+                    return await send(message)
+                # Held until the first body chunk shows whether the response streams
+                start = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                return await send(message)
+
+            body = message.get("body", b"")
+            more = message.get("more_body", False)
+            if start is not None:
+                held, start = start, None
+                if not more and len(body) < self.min_size:
+                    passthrough = True
+                    await send(held)
+                    return await send(message)
+                compressor = ENCODINGS[encoding]()
+                headers = [(k, v) for k, v in held.get("headers", ())
+                           if k.lower() not in (b"content-length", b"vary")]
+                vary = [v for k, v in held.get("headers", ()) if k.lower() == b"vary"]
+                headers.append((b"content-encoding", encoding.encode()))
+                headers.append((b"vary", b", ".join([*vary, b"Accept-Encoding"])))
+                if more:
+                    await send({**held, "headers": headers})
+                else:
+                    data = compressor.compress(body) + compressor.finish()
+                    self._record(encoding, len(body), len(data))
+                    headers.append((b"content-length", str(len(data)).encode()))
+                    await send({**held, "headers": headers})
+                    return await send({"type": "http.response.body", "body": data})
+
+            data = compressor.compress(body) + (compressor.flush() if more else compressor.finish())
+            self._record(encoding, len(body), len(data))
+            await send({"type": "http.response.body", "body": data, "more_body": more})
+
+        await self.app(scope, receive, send_compressed)
+
+    @staticmethod
+    def _record(encoding: str, raw: int, compressed: int):
+        metrics.inc(f"compression.{encoding}.bytes_in", raw)
+        metrics.inc(f"compression.{encoding}.bytes_out", compressed)
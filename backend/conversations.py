@@ -0,0 +1,115 @@
+import os
+
+from db import get_engine
+from messages import Message
+from serialization import dumps
+
+# SQLModel and the table models are imported inside the functions below so
+# they stay off the app's import path (see db.get_engine)
+
+# Rows fetched per query while exporting a conversation
+EXPORT_BATCH_SIZE = 500
+# Saved messages loaded back into memory when a worker first sees a user
+HISTORY_RESTORE_MESSAGES = int(os.getenv("HISTORY_RESTORE_MESSAGES", "40"))
+
+
+def save_messages(username: str, messages):
+    """Persist user/assistant Message objects for a user in one transaction."""
+    save_message_batch([(username, messages)])
+
+
+def save_message_batch(batch):
+    """
+    Persist a batch of (username, [Message, ...]) pairs in one transaction.
+    This is the work queue handler for "messages" items.
+    """
+    from sqlmodel import Session
+    from models import ChatMessage
+
+    with Session(get_engine()) as session:
+        session.add_all(
+            ChatMessage(username=username, role=m.role, content=m.content)
+            for username, messages in batch
+            for m in messages
+        )
+        session.commit()
+
+
+def recent_messages(username: str, limit: int):
+    """Return the user's last limit saved messages, oldest first, as Message objects."""
+    from sqlmodel import Session, select
+    from models import ChatMessage
+
+    stmt = (
+        select(ChatMessage.role, ChatMessage.content)
+        .where(ChatMessage.username == username)
+        .order_by(ChatMessage.id.desc())
+        .limit(limit)
+    )
+    with Session(get_engine()) as session:
+        rows = session.exec(stmt).all()
+    return [Message(role, content) for role, content in reversed(rows)]
+
+
+def _row_to_dict(row) -> dict:
+    return {
+        "id": row.id,
+        "role": row.role,
+        "content": row.content,
+        "created_at": row.created_at.isoformat(),
+    }
+
+
+def page_messages(username: str, cursor: int = None, limit: int = 50):
+    """
+    Return one page of a user's messages, newest first, and the cursor for the next page.
+
+    Pages are keyset-based on the message id (WHERE id < cursor), so every
+    page costs one index range scan no matter how deep the user scrolls.
+    """
+    from sqlmodel import Session, select
+    from models import ChatMessage
+
+    stmt = (
+        select(ChatMessage.id, ChatMessage.role, ChatMessage.content, ChatMessage.created_at)
+        .where(ChatMessage.username == username)
+        .order_by(ChatMessage.id.desc())
+        .limit(limit + 1)
+    )
+    if cursor is not None:
+        stmt = stmt.where(ChatMessage.id < cursor)
+
+    with Session(get_engine()) as session:
+        rows = session.exec(stmt).all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = rows[-1].id if has_more else None
+    return [_row_to_dict(row) for row in rows], next_cursor
+
+
+def export_ndjson(username: str, batch_size: int = EXPORT_BATCH_SIZE):
+    """
+    Yield a user's whole conversation, oldest first, as NDJSON lines.
+
+    Rows are read in keyset batches of batch_size with a short-lived
+    session per batch, so memory stays constant for any conversation
+    length and a slow client never holds a SQLite read lock open.
+    """
+    from sqlmodel import Session, select
+    from models import ChatMessage
+
+    last_id = 0
+    while True:
+        stmt = (
+            select(ChatMessage.id, ChatMessage.role, ChatMessage.content, ChatMessage.created_at)
+            .where(ChatMessage.username == username, ChatMessage.id > last_id)
+            .order_by(ChatMessage.id)
+            .limit(batch_size)
+        )
+        with Session(get_engine()) as session:
+            rows = session.exec(stmt).all()
+        if not rows:
+            return
+        yield b"".join(dumps(_row_to_dict(row)) + b"\n" for row in rows)
+        last_id = rows[-1].id
@@ -1,7 +1,55 @@
-from sqlmodel import SQLModel, create_engine, Session
+DATABASE_URL = "sqlite:///./musemate.db"
 
-engine = create_engine("sqlite:///./musemate.db", echo=True)
+# Bump whenever a table is added so existing databases pick it up. Only new
+# tables (with their indexes) are created: create_all() never adds a column
+# or index to a table that already exists, so those changes need their own
+# statement (e.g. CREATE INDEX IF NOT EXISTS) in init_db().
+# The value is stored in SQLite's PRAGMA user_version.
+SCHEMA_VERSION = 3
+
+_engine = None
+
+def get_engine():
+    """
+    The shared SQLAlchemy engine, created on first use.
+
+    SQLModel/SQLAlchemy take longer to import than the rest of the app, so
+    they are loaded here (normally from the lifespan's init_db()) rather
+    than on the import path of every worker.
+    """
+    global _engine
+    if _engine is None:
+        from sqlmodel import create_engine
+        _engine = create_engine(DATABASE_URL, echo=True)
+    return _engine
 
 def get_session():
-    with Session(engine) as session:
-        yield session
\ No newline at end of file
+    from sqlmodel import Session
+    with Session(get_engine()) as session:
+        yield session
+
+def _schema_version(conn) -> int:
+    return conn.exec_driver_sql("PRAGMA user_version").scalar()
+
+def init_db():
+    """
+    Create missing tables once per schema version.
+
+    Workers that start against an up-to-date database only pay for a single
+    PRAGMA read instead of re-running the DDL checks for every table.
+    """
+    from sqlalchemy.exc import OperationalError
+    from sqlmodel import SQLModel
+    import models  # noqa: F401  (registers the tables on SQLModel.metadata)
+
+    with get_engine().begin() as conn:
+        if _schema_version(conn) >= SCHEMA_VERSION:
+            return
+        try:
+            SQLModel.metadata.create_all(conn)
+        except OperationalError:
+            # Another worker won the race and created the tables first
+            if _schema_version(conn) >= SCHEMA_VERSION:
+                return
+            raise
+        conn.exec_driver_sql(f"PRAGMA user_version = {SCHEMA_VERSION}")
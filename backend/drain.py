@@ -0,0 +1,130 @@
+import asyncio
+import json
+import logging
+import os
+import signal
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait for in-flight chats after a shutdown signal before exiting anyway
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", "25"))
+# Endpoints that spend upstream calls and must finish before the worker exits
+DRAINED_PATHS = {"/chat", "/chat/batch"}
+
+
+class Drain:
+    """
+    Tracks in-flight chat requests and coordinates a graceful shutdown.
+
+    On SIGTERM/SIGINT the worker stops accepting new chats (503 with
+    Retry-After so the load balancer sends them elsewhere), waits up to
+    DRAIN_TIMEOUT for in-flight ones to finish, and only then hands the
+    signal on to uvicorn, which runs the lifespan shutdown that flushes
+    pending writes.
+    """
+
+    def __init__(self, timeout: float = DRAIN_TIMEOUT):
+        self.timeout = timeout
+        self.draining = False
+        self.inflight = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._task = None
+
+    def reset(self):
+        """Accept chats again (called at startup)."""
+        self.draining = False
+        self._task = None
+
+    def enter(self):
+        self.inflight += 1
+        self._idle.clear()
+
+    def exit(self):
+        self.inflight -= 1
+        if self.inflight == 0:
+            self._idle.set()
+
+    async def wait(self, timeout: float = None) -> bool:
+        """Stop accepting new chats and wait for in-flight ones. Returns False on timeout."""
+        self.draining = True
+        try:
+            await asyncio.wait_for(self._idle.wait(), self.timeout if timeout is None else timeout)
+            return True
+        except asyncio.TimeoutError:
+            logger.warning("Drain deadline passed with %d chats still in flight", self.inflight)
+            metrics.inc("drain.abandoned", self.inflight)
+            return False
+
+    def install_signal_handlers(self):
+        """
+        Wrap the server's SIGTERM/SIGINT handlers so a shutdown signal
+        drains in-flight chats before the server starts closing connections.
+        Call from lifespan startup, after uvicorn has installed its handlers.
+        """
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            original = signal.getsignal(sig)
+            if not callable(original):
+                continue
+
+            def handler(signum, frame, original=original):
+                if self._task is not None:
+                    # Second signal: stop waiting
+                    original(signum, frame)
+                    return
+                loop.call_soon_threadsafe(self._begin, original, signum, frame)
+
+            try:
+                signal.signal(sig, handler)
+            except ValueError:
+                # Not on the main thread (e.g. under a test client): nothing to wrap
+                return
+
+    def _begin(self, original, signum, frame):
+        async def drain_then_exit():
+            logger.info("Shutdown signal received, draining %d in-flight chats", self.inflight)
+            await self.wait()
+            original(signum, frame)
+
+        self._task = asyncio.get_running_loop().create_task(drain_then_exit())
+
+
+class DrainMiddleware:
+    """ASGI middleware counting in-flight chats and refusing new ones while draining."""
+
+    def __init__(self, app, drain: Drain, paths=DRAINED_PATHS):
+        self.app = app
+        self.drain = drain
+        self.paths = paths
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            return await self.app(scope, receive, send)
+
+        if self.drain.draining:
+            metrics.inc("drain.rejected")
+            body = json.dumps({"detail": "Server is shutting down"}).encode()
+            await send({
+                "type": "http.response.start",
+                "status": 503,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"retry-after", b"1"),
+                    (b"connection", b"close"),
+                ],
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        self.drain.enter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.drain.exit()
+
+
+drain = Drain()
@@ -0,0 +1,218 @@
+import asyncio
+import logging
+import os
+import sys
+import time
+import zlib
+
+from messages import Message
+from metrics import metrics
+from serialization import dumps, loads
+
+try:
+    import zstandard
+except ImportError:  # optional: zlib is always available
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# Conversations untouched for this many seconds move to the compressed tier
+HISTORY_IDLE_SECONDS = float(os.getenv("HISTORY_IDLE_SECONDS", "900"))
+# How often the compactor scans for idle conversations
+HISTORY_COMPACT_INTERVAL = float(os.getenv("HISTORY_COMPACT_INTERVAL", "60"))
+
+
+class _Codec:
+    """Fast compression for cold histories: zstd level 1 if installed, else zlib level 1."""
+
+    def __init__(self):
+        if zstandard is not None:
+            self.name = "zstd"
+            self._compressor = zstandard.ZstdCompressor(level=1)
+            self._decompressor = zstandard.ZstdDecompressor()
+        else:
+            self.name = "zlib"
+
+    def compress(self, data: bytes) -> bytes:
+        if zstandard is not None:
+            return self._compressor.compress(data)
+        return zlib.compress(data, 1)
+
+    def decompress(self, data: bytes) -> bytes:
+        if zstandard is not None:
+            return self._decompressor.decompress(data)
+        return zlib.decompress(data)
+
+
+class HistoryStore:
+    """
+    Per-user conversation histories with a compressed cold tier.
+
+    Active conversations are plain lists of Message objects. Conversations
+    idle for longer than idle_seconds are serialized and compressed by
+    compact(), and decompressed transparently the next time get() is called
+    for that user.
+
+    Shared messages (the system prompt and suggestion hints) are stored as
+    references, so a decompressed history points at the same objects again
+    instead of carrying its own copies. When a catalog reload replaces them,
+    unshare() drops the old ones once no compressed history refers to them.
+
+    A history returned by get() must not be held across an idle period: the
+    compactor only takes conversations that have not been touched for
+    idle_seconds, which is far longer than any single /chat request.
+    """
+
+    def __init__(self, idle_seconds: float = HISTORY_IDLE_SECONDS, shared=()):
+        self.idle_seconds = idle_seconds
+        self._codec = _Codec()
+        self._hot = {}          # username -> list[Message]
+        self._last_used = {}    # username -> monotonic time of last access
+        self._cold = {}         # username -> (compressed bytes, uncompressed size, shared keys)
+        self._raw_bytes = 0     # uncompressed size of everything in the cold tier
+        self._cold_bytes = 0
+        self._shared = {}       # key -> message, for thawing
+        self._shared_ids = {}   # id(message) -> key, for messages currently shared
+        self._shared_refs = {}  # key -> number of cold histories referring to it
+        self._next_shared = 0
+        for message in shared:
+            self.share(message)
+
+    def share(self, message: Message):
+        """Register a message that many histories reference, e.g. the system prompt."""
+        key = self._next_shared
+        self._next_shared += 1
+        self._shared[key] = message
+        self._shared_ids[id(message)] = key
+
+    def unshare(self, message: Message):
+        """
+        Stop sharing a message, e.g. the previous catalog's system prompt.
+        It is kept only while compressed histories still refer to it.
+        """
+        key = self._shared_ids.pop(id(message), None)
+        if key is not None and not self._shared_refs.get(key):
+            del self._shared[key]
+
+    def _release(self, keys):
+        # A cold history referring to these shared keys was thawed or dropped
+        for key in keys:
+            refs = self._shared_refs[key] - 1
+            if refs:
+                self._shared_refs[key] = refs
+                continue
+            del self._shared_refs[key]
+            if self._shared_ids.get(id(self._shared[key])) != key:
+                del self._shared[key]
+
+    def __contains__(self, username: str) -> bool:
+        return username in self._hot or username in self._cold
+
+    def __len__(self) -> int:
+        return len(self._hot) + len(self._cold)
+
+    def get(self, username: str):
+        """Return the user's history (decompressing it if cold), or None."""
+        history = self._hot.get(username)
+        if history is None:
+            entry = self._cold.pop(username, None)
+            if entry is None:
+                return None
+            blob, raw_size, keys = entry
+            history = self._thaw(blob, raw_size)
+            self._release(keys)
+            self._hot[username] = history
+        self._last_used[username] = time.monotonic()
+        return history
+
+    def set(self, username: str, history: list):
+        self.discard(username)
+        self._hot[username] = history
+        self._last_used[username] = time.monotonic()
+
+    def discard(self, username: str):
+        self._hot.pop(username, None)
+        self._last_used.pop(username, None)
+        entry = self._cold.pop(username, None)
+        if entry is not None:
+            self._cold_bytes -= len(entry[0])
+            self._raw_bytes -= entry[1]
+            self._release(entry[2])
+
+    def _freeze(self, history: list):
+        # Returns the serialized history and the shared keys it refers to
+        shared_ids = self._shared_ids
+        items = [
+            shared_ids[id(m)] if id(m) in shared_ids else (m.role, m.content)
+            for m in history
+        ]
+        return dumps(items), frozenset(item for item in items if isinstance(item, int))
+
+    def _thaw(self, blob: bytes, raw_size: int) -> list:
+        start = time.perf_counter()
+        raw = self._codec.decompress(blob)
+        shared = self._shared
+        history = [
+            shared[item] if isinstance(item, int) else Message(item[0], item[1])
+            for item in loads(raw)
+        ]
+        metrics.observe("history.decompress_ms", (time.perf_counter() - start) * 1000)
+        self._cold_bytes -= len(blob)
+        self._raw_bytes -= raw_size
+        return history
+
+    def compact(self, now: float = None) -> int:
+        """Compress every conversation idle past idle_seconds. Returns how many moved."""
+        now = time.monotonic() if now is None else now
+        cutoff = now - self.idle_seconds
+        idle = [u for u, last in self._last_used.items() if last < cutoff and u in self._hot]
+        for username in idle:
+            raw, keys = self._freeze(self._hot.pop(username))
+            blob = self._codec.compress(raw)
+            self._cold[username] = (blob, len(raw), keys)
+            for key in keys:
+                self._shared_refs[key] = self._shared_refs.get(key, 0) + 1
+            self._raw_bytes += len(raw)
+            self._cold_bytes += len(blob)
+            del self._last_used[username]
+        if idle:
+            metrics.inc("history.compressed", len(idle))
+        return len(idle)
+
+    def stats(self) -> dict:
+        return {
+            "hot": len(self._hot),
+            "cold": len(self._cold),
+            "codec": self._codec.name,
+            "cold_bytes": self._cold_bytes,
+            "cold_raw_bytes": self._raw_bytes,
+            "compression_ratio": round(self._raw_bytes / self._cold_bytes, 2) if self._cold_bytes else None,
+        }
+
+    def user_stats(self, top: int = 20) -> list:
+        """
+        Approximate memory held per user, largest first. Shared messages
+        (system prompt, hints) are not counted against anyone.
+        """
+        shared_ids = self._shared_ids
+        sizes = []
+        for username, history in list(self._hot.items()):
+            size = sys.getsizeof(history) + sum(
+                sys.getsizeof(m) + sys.getsizeof(m.content)
+                for m in history if id(m) not in shared_ids
+            )
+            sizes.append({"username": username, "tier": "hot", "messages": len(history), "bytes": size})
+        for username, (blob, raw_size, _) in list(self._cold.items()):
+            sizes.append({"username": username, "tier": "cold", "messages": None, "bytes": len(blob),
+                          "raw_bytes": raw_size})
+        sizes.sort(key=lambda s: s["bytes"], reverse=True)
+        return sizes[:top]
+
+    async def run(self, interval: float = HISTORY_COMPACT_INTERVAL):
+        """Background loop that moves idle conversations to the cold tier."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.compact()
+            except Exception as e:
+                logger.warning("History compaction failed: %s", e)
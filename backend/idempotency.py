@@ -0,0 +1,87 @@
+import asyncio
+import hashlib
+import os
+import time
+from collections import OrderedDict
+
+from fastapi import HTTPException
+
+from metrics import metrics
+
+# How long a completed request can be replayed by sending the same key again
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", "600"))
+# Maximum number of remembered keys per worker
+IDEMPOTENCY_MAX_KEYS = int(os.getenv("IDEMPOTENCY_MAX_KEYS", "10000"))
+
+
+class IdempotencyCache:
+    """
+    Bounded TTL cache of request results keyed by (username, Idempotency-Key).
+
+    The first request for a key runs and stores its result. A duplicate
+    that arrives while it is still running awaits the same future, and one
+    that arrives later gets the stored result, so neither reaches upstream.
+    Failed requests are forgotten so the client can retry them.
+    """
+
+    def __init__(self, ttl: float = IDEMPOTENCY_TTL, max_keys: int = IDEMPOTENCY_MAX_KEYS):
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self._entries = OrderedDict()  # key -> (fingerprint, future, expires)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _evict(self, now: float):
+        # Entries are inserted with a fixed TTL, so the oldest expire first
+        entries = self._entries
+        while entries:
+            key, (_, _, expires) = next(iter(entries.items()))
+            if expires < now or len(entries) > self.max_keys:
+                del entries[key]
+            else:
+                break
+
+    async def run(self, key, fingerprint: str, fn):
+        """
+        Run fn() once per key and return its result; duplicates get the same result.
+
+        Returns (result, replayed). Raises 422 if the key was already used
+        for a request with a different fingerprint.
+        """
+        now = time.monotonic()
+        self._evict(now)
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            stored_fingerprint, future, _ = entry
+            if stored_fingerprint != fingerprint:
+                raise HTTPException(status_code=422, detail="Idempotency-Key was reused with a different request")
+            metrics.inc("idempotency.replayed" if future.done() else "idempotency.joined")
+            # shield: a duplicate that disconnects must not cancel the original
+            return await asyncio.shield(future), True
+
+        future = asyncio.get_running_loop().create_future()
+        self._entries[key] = (fingerprint, future, now + self.ttl)
+        self._evict(now)
+        try:
+            result = await fn()
+        except BaseException as e:
+            if self._entries.get(key, (None, None))[1] is future:
+                del self._entries[key]
+            if isinstance(e, asyncio.CancelledError):
+                # The original's client went away. Duplicates waiting on it
+                # were not cancelled themselves, so they get a retryable error.
+                future.set_exception(HTTPException(status_code=503, detail="Original request was cancelled, retry"))
+            else:
+                future.set_exception(e)
+            # Nobody may be waiting; mark the exception as retrieved
+            future.exception()
+            raise
+        future.set_result(result)
+        return result, False
+
+
+def fingerprint(*parts: str) -> str:
+    """Stable hash of the request fields that must match on replay."""
+    return hashlib.sha256("\0".join(parts).encode()).hexdigest()
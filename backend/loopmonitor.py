@@ -0,0 +1,129 @@
+import asyncio
+import collections
+import contextlib
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Seconds between event-loop heartbeats
+LOOP_MONITOR_INTERVAL = float(os.getenv("LOOP_MONITOR_INTERVAL", "0.1"))
+# A callback holding the loop longer than this (ms) is reported with its stack
+LOOP_BLOCK_THRESHOLD_MS = float(os.getenv("LOOP_BLOCK_THRESHOLD_MS", "100"))
+# Blocking reports kept for GET /metrics
+LOOP_BLOCK_HISTORY = int(os.getenv("LOOP_BLOCK_HISTORY", "20"))
+
+
+class LoopMonitor:
+    """
+    Measures event-loop lag and catches callbacks that block the loop.
+
+    A task on the loop wakes every interval and records how late it woke
+    (event_loop.lag_ms). A watchdog thread checks the task's heartbeat;
+    when the loop has not come back for threshold_ms it grabs the loop
+    thread's current stack, which is the code doing the blocking, and logs
+    it once per stall. Both run only while the monitor is started.
+    """
+
+    def __init__(self, interval: float = LOOP_MONITOR_INTERVAL, threshold_ms: float = LOOP_BLOCK_THRESHOLD_MS,
+                 history: int = LOOP_BLOCK_HISTORY):
+        self.interval = interval
+        self.threshold = threshold_ms / 1000
+        self.lag_ms = 0.0
+        self.max_lag_ms = 0.0
+        self.blocks = collections.deque(maxlen=history)
+        self._listeners = []
+        self._heartbeat = 0.0
+        self._loop_thread = None
+        self._task = None
+        self._stop = threading.Event()
+        self._watchdog = None
+
+    def start(self):
+        """Start monitoring the running event loop."""
+        if self._task is not None:
+            return
+        self._loop_thread = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.get_running_loop().create_task(self._tick())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+    def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        self._task = None
+        self._stop.set()
+        self._watchdog.join(timeout=1)
+        self._watchdog = None
+
+    async def _tick(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._heartbeat = now
+            self.lag_ms = max(0.0, now - expected) * 1000
+            self.max_lag_ms = max(self.max_lag_ms, self.lag_ms)
+            metrics.observe("event_loop.lag_ms", self.lag_ms)
+
+    def _watch(self):
+        reported = None
+        while not self._stop.wait(self.threshold / 2):
+            heartbeat = self._heartbeat
+            stalled = time.monotonic() - heartbeat - self.interval
+            if stalled < self.threshold or heartbeat == reported:
+                continue
+            # One report per stall: the heartbeat stays put until the loop recovers
+            reported = heartbeat
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            block = {
+                "at": time.time(),
+                "blocked_ms": round(stalled * 1000, 1),
+                "stack": "".join(traceback.format_stack(frame)),
+            }
+            self.blocks.append(block)
+            for listener in list(self._listeners):
+                listener.append(block)
+            metrics.inc("event_loop.blocked")
+            logger.warning("Event loop blocked for %.0f ms in:\n%s", block["blocked_ms"], block["stack"])
+
+    @contextlib.contextmanager
+    def capture(self):
+        """
+        Collect blocking reports made inside the with-block, e.g. in a test:
+
+            with loop_monitor.capture() as blocks:
+                client.post("/chat", ...)
+            assert not blocks
+        """
+        blocks = []
+        self._listeners.append(blocks)
+        try:
+            yield blocks
+        finally:
+            self._listeners.remove(blocks)
+
+    def stats(self) -> dict:
+        return {
+            "lag_ms": round(self.lag_ms, 2),
+            "max_lag_ms": round(self.max_lag_ms, 2),
+            "threshold_ms": self.threshold * 1000,
+            "recent_blocks": [
+                {"at": b["at"], "blocked_ms": b["blocked_ms"], "where": b["stack"].splitlines()[-2:]}
+                for b in self.blocks
+            ],
+        }
+
+
+loop_monitor = LoopMonitor()
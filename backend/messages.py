@@ -0,0 +1,48 @@
+import sys
+
+# Interned role names. Messages built from other strings (e.g. rows read back
+# from the database) are interned on construction so every history shares
+# these four objects.
+SYSTEM = sys.intern("system")
+USER = sys.intern("user")
+ASSISTANT = sys.intern("assistant")
+
+
+class Message:
+    """
+    A single chat message.
+
+    Slotted to avoid a per-message __dict__ (48 bytes vs. 184 for the
+    {"role": ..., "content": ...} dict it replaces), and immutable so one
+    instance, like the system prompt, can be shared by every history.
+    """
+
+    __slots__ = ("role", "content")
+
+    def __init__(self, role: str, content: str):
+        object.__setattr__(self, "role", sys.intern(role))
+        object.__setattr__(self, "content", content)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Message is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("Message is immutable")
+
+    def __eq__(self, other):
+        if not isinstance(other, Message):
+            return NotImplemented
+        return self.role == other.role and self.content == other.content
+
+    def __hash__(self):
+        return hash((self.role, self.content))
+
+    def __repr__(self):
+        return f"Message(role={self.role!r}, content={self.content!r})"
+
+    def __reduce__(self):
+        return (Message, (self.role, self.content))
+
+    def to_dict(self) -> dict:
+        """Wire format expected by the Llama chat completions API."""
+        return {"role": self.role, "content": self.content}
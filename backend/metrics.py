@@ -0,0 +1,52 @@
+import threading
+
+
+class Metrics:
+    """
+    Minimal in-process metrics registry.
+
+    Counters and summaries (count/sum/max) are updated inline; gauges are
+    callables evaluated when a snapshot is taken, so reporting costs nothing
+    on the request path.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._summaries = {}
+        self._gauges = {}
+
+    def inc(self, name: str, amount: float = 1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def observe(self, name: str, value: float):
+        with self._lock:
+            summary = self._summaries.get(name)
+            if summary is None:
+                self._summaries[name] = [1, value, value]
+            else:
+                summary[0] += 1
+                summary[1] += value
+                if value > summary[2]:
+                    summary[2] = value
+
+    def gauge(self, name: str, fn):
+        """Register fn() to be evaluated for name on every snapshot."""
+        self._gauges[name] = fn
+
+    def counter(self, name: str) -> float:
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            data = dict(self._counters)
+            for name, (count, total, maximum) in self._summaries.items():
+                data[name] = {"count": count, "avg": total / count, "max": maximum}
+        for name, fn in self._gauges.items():
+            data[name] = fn()
+        return data
+
+
+metrics = Metrics()
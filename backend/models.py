@@ -1,6 +1,32 @@
+import datetime
+
+from sqlalchemy import Index, UniqueConstraint
 from sqlmodel import SQLModel, Field
 
 class User(SQLModel, table=True):
     id: int = Field(default=None, primary_key=True)
     username: str = Field(index=True, unique=True)
-    password_hash: str
\ No newline at end of file
+    password_hash: str
+
+class TokenUsage(SQLModel, table=True):
+    # One row per user per UTC day, accumulated by the usage flusher
+    __table_args__ = (UniqueConstraint("username", "day"),)
+
+    id: int = Field(default=None, primary_key=True)
+    username: str = Field(index=True)
+    day: str = Field(index=True)  # ISO date, e.g. "2025-05-01"
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    requests: int = 0
+
+class ChatMessage(SQLModel, table=True):
+    # User and assistant turns, read back by GET /history with keyset pagination
+    __table_args__ = (Index("ix_chatmessage_username_id", "username", "id"),)
+
+    id: int = Field(default=None, primary_key=True)
+    username: str
+    role: str
+    content: str
+    created_at: datetime.datetime = Field(
+        default_factory=lambda: datetime.datetime.now(datetime.timezone.utc)
+    )
@@ -1,97 +1,221 @@
-from fastapi import FastAPI, Request, HTTPException, Depends
+from fastapi import FastAPI, APIRouter, Request, Response, HTTPException, Depends, Query
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-import requests
-from auth import create_user, authenticate_user, verify_token
-from sqlmodel import SQLModel
-from db import engine, get_session
+from pydantic import BaseModel, Field
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
+
+# Modules read their settings with os.getenv when they are imported, so
+# .env has to be loaded before any of them
+load_dotenv()
+
+from auth import create_user, authenticate_user, verify_token, is_admin
+from usage import usage_tracker, estimate_tokens, usage_from_response
+from db import init_db, get_session
+from messages import Message, SYSTEM, USER, ASSISTANT
+from history import HistoryStore
+from ratelimit import RateLimitMiddleware
+from conversations import save_message_batch, page_messages, export_ndjson, recent_messages, HISTORY_RESTORE_MESSAGES
+from idempotency import IdempotencyCache, fingerprint
+from tasks import work_queue
+from upstream import LlamaClient, UpstreamError, LLAMA_MODEL, reply_text
+from scheduler import lane_for, INTERACTIVE, BULK, BACKGROUND
+from promptcache import semantic_cache
+from drain import drain, DrainMiddleware
+from summarizer import Summarizer
+from catalog import CatalogSource
+from readiness import Readiness
+from loopmonitor import loop_monitor
+from profiling import profiler, ProfilerBusy, PROFILE_MAX_SECONDS
+from metrics import metrics
+from compression import CompressionMiddleware
+from traffic import traffic_recorder
+from tracing import TraceMiddleware, configure_logging, stop_logging, span
+from serialization import FastJSONResponse, message_encoder, dumps
 import os
+import asyncio
+import logging
+import time
 from typing import List, Optional  # Added for type hints
 
-# Business Links Dictionary - Structured data for our services
-# Each service has:
-# - name: Display name of the business
-# - url: Website link
-# - description: Short business description
-# - keywords: List of words that trigger service suggestions
-BUSINESS_LINKS = {
-    "screen_printing": {
-        "name": "Oddly Specific Prints",
-        "url": "https://oddlyspecificprints.com",
-        "description": "Ethical, eco-friendly screen printing by artists, for artists",
-        "keywords": ["screen printing", "t-shirts", "merchandise", "apparel", "clothing"]
-    },
-    "creative_hub": {
-        "name": "Craybo",
-        "url": "https://craybo.com",
-        "description": "Your creative community for events, equipment, and artistic collaboration",
-        "keywords": ["events", "equipment", "lights", "artists", "creative space"]
-    }
-}
-
-# Initialize FastAPI and load environment variables
-load_dotenv()
-SQLModel.metadata.create_all(engine)
-app = FastAPI()
-
-# CORS Middleware setup
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-# Load API key
-LLAMA_API_KEY = os.getenv("LLAMA_API_KEY")
-if not LLAMA_API_KEY:
-    raise Exception("LLAMA_API_KEY not set in environment variables")
-
-# Store chat histories in memory
-conversation_histories = {}
+logger = logging.getLogger(__name__)
 
-# Helper Functions
-def should_suggest_service(message: str, service_id: str) -> bool:
+# Most prompts accepted by one /chat/batch request, and how many of them
+# are sent upstream at the same time
+CHAT_BATCH_MAX_ITEMS = int(os.getenv("CHAT_BATCH_MAX_ITEMS", "100"))
+CHAT_BATCH_CONCURRENCY = int(os.getenv("CHAT_BATCH_CONCURRENCY", "8"))
+
+# Business catalog (services, keywords, link cards), compiled once and
+# hot-reloaded from catalog.json. Every history starts with the catalog's
+# shared system prompt object rather than its own copy.
+catalogs = CatalogSource(on_reload=lambda catalog, previous: share_catalog(catalog, previous))
+
+# Store chat histories in memory; idle conversations are compressed
+conversation_histories = HistoryStore()
+metrics.gauge("history", conversation_histories.stats)
+
+def share_catalog(catalog, previous=None):
     """
-    Check if a user's message contains keywords that should trigger a service suggestion.
-    
-    Args:
-        message: The user's message
-        service_id: The service to check keywords for
-    Returns:
-        bool: True if message contains relevant keywords
+    Register a catalog's prompt and hints with the history store, and
+    encode them once for every upstream request body. The previous
+    catalog's messages are released so reloads do not pile up.
+    """
+    if previous is not None:
+        for message in previous.shared_messages():
+            conversation_histories.unshare(message)
+            message_encoder.unpin(message)
+    for message in catalog.shared_messages():
+        conversation_histories.share(message)
+        message_encoder.pin(message)
+
+share_catalog(catalogs.current)
+
+# Compacts long histories in the background
+summarizer = Summarizer(conversation_histories)
+metrics.gauge("summarizer.pending", summarizer.pending)
+
+# Recent /chat results by (username, Idempotency-Key)
+idempotency_cache = IdempotencyCache()
+
+# Cached deep health check for the load balancer
+readiness = Readiness()
+
+router = APIRouter()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Startup and shutdown work that should not run at import time.
+
+    Schema creation is skipped when the database is already at the current
+    schema version, and usage totals are loaded before serving. On
+    shutdown, in-flight chats finish before queued writes are flushed.
+    """
+    # Watch for lag and blocking calls on the event loop from the start
+    loop_monitor.start()
+    metrics.gauge("event_loop", loop_monitor.stats)
+
+    await asyncio.to_thread(init_db)
+    drain.reset()
+
+    # Pooled upstream client, warmed before the first chat arrives
+    llama = LlamaClient(app.state.llama_api_key)
+    app.state.llama = llama
+    metrics.gauge("upstream", llama.stats)
+    metrics.gauge("scheduler", llama.scheduler.stats)
+    metrics.gauge("semantic_cache", semantic_cache.stats)
+    try:
+        await llama.prewarm()
+    except Exception as e:
+        logger.warning("Llama API pre-warm failed: %s", e)
+    keepalive_task = asyncio.create_task(llama.keepalive())
+
+    # Usage accounting: load today's totals, then flush (and re-read them) in the background
+    await asyncio.to_thread(usage_tracker.load)
+    usage_flush_task = asyncio.create_task(usage_tracker.run())
+    compact_task = asyncio.create_task(conversation_histories.run())
+    catalog_task = asyncio.create_task(catalogs.watch())
+
+    # Post-response work (message persistence, analytics) drains in batches
+    work_queue.register("messages", save_message_batch)
+    work_queue.register("chat_events", record_chat_events)
+    if traffic_recorder.enabled:
+        work_queue.register("traffic", traffic_recorder.write)
+    work_queue.start()
+
+    # Let a shutdown signal drain in-flight chats before uvicorn stops serving
+    drain.install_signal_handlers()
+    metrics.gauge("chat.inflight", lambda: drain.inflight)
+
+    # Low-priority summarization of long histories
+    summarize_task = asyncio.create_task(summarizer.run(llama, lambda: drain.inflight))
+
+    yield
+
+    # Shutdown: refuse new chats, let in-flight ones finish, then flush
+    # queued history writes and usage before exiting
+    await drain.wait()
+    summarize_task.cancel()
+    await work_queue.close()
+    compact_task.cancel()
+    catalog_task.cancel()
+    usage_flush_task.cancel()
+    keepalive_task.cancel()
+    llama.close()
+    usage_tracker.flush()
+    loop_monitor.stop()
+    stop_logging()
+
+def create_app() -> FastAPI:
     """
-    keywords = BUSINESS_LINKS[service_id]["keywords"]
-    message_lower = message.lower()
-    return any(keyword in message_lower for keyword in keywords)
+    Build the MuseMate application.
 
-def process_business_links(reply: str) -> str:
+    Run with `uvicorn musemate:app`, or `uvicorn musemate:create_app --factory`
+    to build the app per worker.
+    """
+    # Buffered structured logging; the event loop only enqueues records
+    configure_logging()
+
+    # Load API key
+    llama_api_key = os.getenv("LLAMA_API_KEY")
+    if not llama_api_key:
+        raise Exception("LLAMA_API_KEY not set in environment variables")
+
+    app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
+    app.state.llama_api_key = llama_api_key
+
+    # Track in-flight chats so shutdown can wait for them
+    app.add_middleware(DrainMiddleware, drain=drain)
+
+    # Rate limiting sits inside CORS so 429 responses still carry CORS headers
+    app.add_middleware(RateLimitMiddleware)
+
+    # Compress large and streaming responses for clients that accept it
+    app.add_middleware(CompressionMiddleware)
+
+    # CORS Middleware setup
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+
+    # Outermost: every request, including rejected ones, gets a trace ID
+    app.add_middleware(TraceMiddleware)
+
+    app.include_router(router)
+    return app
+
+# Helper Functions
+def process_business_links(reply: str, catalog) -> str:
     """
     Replace link tags with formatted business information.
     Example: [LINK:screen_printing] becomes a formatted business card
     
     Args:
         reply: The AI's response containing link tags
+        catalog: The business catalog the request started with
     Returns:
         str: Formatted response with business information
     """
     try:
-        for service_id, info in BUSINESS_LINKS.items():
-            tag = f"[LINK:{service_id}]"
-            if tag in reply:
-                formatted_link = (
-                    f"\n\n🔗 Connect with {info['name']}\n"
-                    f"💼 {info['description']}\n"
-                    f"🌐 Visit: {info['url']}\n"
-                )
-                reply = reply.replace(tag, formatted_link)
-        return reply
+        return catalog.render_links(reply)
     except Exception as e:
-        print(f"Error processing business links: {e}")
+        logger.exception("Error processing business links: %s", e)
         return reply
 
+def record_chat_events(events: list):
+    """
+    Aggregate per-chat analytics events into metrics.
+    Runs on the work queue, off the response path.
+    """
+    for event in events:
+        metrics.observe("chat.upstream_ms", event["upstream_ms"])
+        metrics.observe("chat.history_messages", event["history_messages"])
+        metrics.observe("chat.reply_chars", event["reply_chars"])
+
 # Data Models
 class AuthData(BaseModel):
     username: str
@@ -100,28 +224,137 @@ class AuthData(BaseModel):
 class ChatRequest(BaseModel):
     content: str
 
+class BatchChatRequest(BaseModel):
+    prompts: List[str] = Field(min_length=1, max_length=CHAT_BATCH_MAX_ITEMS)
+
+async def get_current_user(request: Request) -> str:
+    """Dependency that returns the username from a valid Bearer token"""
+    # Already verified by the rate limiter for rate-limited endpoints
+    username = getattr(request.state, "username", None)
+    if username:
+        return username
+
+    auth_header = request.headers.get("Authorization")
+    if not auth_header or not auth_header.startswith("Bearer "):
+        raise HTTPException(status_code=401, detail="Missing token")
+
+    token = auth_header.split(" ")[1]
+    username = verify_token(token)
+    if not username:
+        raise HTTPException(status_code=401, detail="Invalid or expired token")
+    return username
+
+async def require_admin(username: str = Depends(get_current_user)) -> str:
+    """Dependency that only lets users listed in ADMIN_USERS through"""
+    if not is_admin(username):
+        raise HTTPException(status_code=403, detail="Admin only")
+    return username
+
 # Endpoints
-@app.post("/signup")
+@router.post("/signup")
 def signup(auth: AuthData, session=Depends(get_session)):
     success = create_user(auth.username, auth.password, session)
     if not success:
         raise HTTPException(status_code=400, detail="Username already exists")
     return {"message": "User created!"}
 
-@app.post("/login")
+@router.post("/login")
 def login(auth: AuthData, session=Depends(get_session)):
     token = authenticate_user(auth.username, auth.password, session)
     if not token:
         raise HTTPException(status_code=401, detail="Invalid credentials")
     return {"token": token}
 
-@app.get("/")
+@router.get("/")
 def health_check():
     """Endpoint to verify the API is running"""
     return {"status": "ok"}
 
-@app.post("/chat")
-async def chat(request: Request, body: ChatRequest):
+@router.get("/ready")
+async def ready_check(request: Request, response: Response):
+    """
+    Deep health check: database, work queue and event-loop lag, plus the
+    upstream circuit state (reported only). Returns 503 when this worker
+    should not receive traffic.
+    """
+    result = await readiness.check(request.app)
+    if not result["ready"]:
+        response.status_code = 503
+    return result
+
+@router.get("/metrics")
+def get_metrics(admin: str = Depends(require_admin)):
+    """In-process counters and gauges for this worker (admin only: includes source locations of loop blocks)"""
+    return metrics.snapshot()
+
+@router.post("/admin/profile/cpu")
+async def profile_cpu(
+    seconds: float = Query(10, gt=0, le=PROFILE_MAX_SECONDS),
+    format: str = Query("collapsed", pattern="^(collapsed|pstats)$"),
+    admin: str = Depends(require_admin),
+):
+    """
+    Profile this worker for the given number of seconds and download the result:
+    collapsed stacks sampled from every thread, or a cProfile pstats file of the
+    event-loop thread (load with pstats.Stats or snakeviz).
+    """
+    try:
+        if format == "pstats":
+            body = await profiler.cpu_pstats(seconds)
+            return Response(body, media_type="application/octet-stream",
+                            headers={"Content-Disposition": 'attachment; filename="musemate.pstats"'})
+        body = await profiler.cpu_collapsed(seconds)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return Response(body, media_type="text/plain",
+                    headers={"Content-Disposition": 'attachment; filename="musemate.collapsed"'})
+
+@router.post("/admin/profile/memory")
+async def profile_memory(
+    seconds: float = Query(10, gt=0, le=PROFILE_MAX_SECONDS),
+    top: int = Query(25, ge=1, le=200),
+    admin: str = Depends(require_admin),
+):
+    """Trace allocations for the given number of seconds and report the top allocating lines"""
+    try:
+        return {"allocators": await profiler.allocations(seconds, top)}
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@router.get("/admin/history-stats")
+def history_stats(top: int = Query(20, ge=1, le=1000), admin: str = Depends(require_admin)):
+    """Largest in-memory conversation histories on this worker"""
+    return {"totals": conversation_histories.stats(), "users": conversation_histories.user_stats(top)}
+
+@router.get("/history")
+def get_history(
+    cursor: Optional[int] = None,
+    limit: int = Query(50, ge=1, le=200),
+    username: str = Depends(get_current_user),
+):
+    """
+    Page through the user's saved messages, newest first.
+    Pass the returned next_cursor to fetch the next (older) page.
+    """
+    messages, next_cursor = page_messages(username, cursor, limit)
+    return {"messages": messages, "next_cursor": next_cursor}
+
+@router.get("/history/export")
+def export_history(username: str = Depends(get_current_user)):
+    """Stream the user's whole conversation as NDJSON, oldest first"""
+    return StreamingResponse(
+        export_ndjson(username),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="musemate-history.ndjson"'},
+    )
+
+@router.post("/chat")
+async def chat(
+    request: Request,
+    body: ChatRequest,
+    response: Response,
+    username: str = Depends(get_current_user),
+):
     
    # Main chat endpoint that:
    # 1. Validates user authentication
@@ -130,79 +363,271 @@ async def chat(request: Request, body: ChatRequest):
    # 4. Handles business suggestions
     #5. Returns AI responses
    
-    # Authentication check
-    auth_header = request.headers.get("Authorization")
-    if not auth_header or not auth_header.startswith("Bearer "):
-        raise HTTPException(status_code=401, detail="Missing token")
+    # Retries and double-submits that reuse an Idempotency-Key get the
+    # original reply instead of a second upstream call and history entry
+    started = time.perf_counter()
+    timings = {}
+    status = 200
+    replayed = False
+    lane = lane_for(username, request.headers.get("X-Priority"), INTERACTIVE)
+    try:
+        idempotency_key = request.headers.get("Idempotency-Key")
+        if not idempotency_key:
+            result = await chat_turn(request.app, username, body.content, timings, lane)
+        else:
+            result, replayed = await idempotency_cache.run(
+                (username, idempotency_key),
+                fingerprint(body.content),
+                lambda: chat_turn(request.app, username, body.content, timings, lane),
+            )
+            if replayed:
+                response.headers["Idempotent-Replayed"] = "true"
+        return result
+    except HTTPException as e:
+        status = e.status_code
+        raise
+    except asyncio.CancelledError:
+        # Client went away (nginx's "client closed request")
+        status = 499
+        raise
+    except Exception:
+        status = 500
+        raise
+    finally:
+        # Replays of an earlier reply made no upstream call and would be
+        # replayed as fresh chats, so they are not recorded
+        if traffic_recorder.enabled and not replayed:
+            work_queue.offer("traffic", traffic_recorder.event(
+                username,
+                prompt_chars=len(body.content),
+                history_messages=timings.get("history_messages", 0),
+                reply_chars=timings.get("reply_chars", 0),
+                upstream_ms=timings.get("upstream_ms", 0),
+                total_ms=(time.perf_counter() - started) * 1000,
+                status=status,
+            ))
 
-    token = auth_header.split(" ")[1]
-    username = verify_token(token)
-    if not username:
-        raise HTTPException(status_code=401, detail="Invalid or expired token")
+@router.post("/chat/batch")
+async def chat_batch(request: Request, body: BatchChatRequest, username: str = Depends(get_current_user)):
+    """
+    Answer a list of independent one-off prompts (captions, merch copy).
 
-    message = body.content
+    Prompts do not see or join the user's conversation history. Up to
+    CHAT_BATCH_CONCURRENCY of them run upstream at once and results stream
+    back as NDJSON lines in completion order:
+    {"index": 3, "status": 200, "reply": ...} or
+    {"index": 4, "status": 429, "error": ...}.
 
-    # Initialize or get user's conversation history
-    if username not in conversation_histories:
-        conversation_histories[username] = [
-            {
-                "role": "system",
-                "content": (
-                    "You are MuseMate, an AI creative assistant. Follow these rules:\n"
-                    "1. When users need creative services, suggest relevant businesses.\n"
-                    "2. Use special tags to recommend services:\n"
-                    "   - For screen printing: [LINK:screen_printing]\n"
-                    "   - For creative hub services: [LINK:creative_hub]\n"
-                    "3. Example: 'If you need help with merchandise or printing check out, [LINK:screen_printing]'\n"
-                    "4. Be natural in your suggestions, don't force them.\n"
-                    "5. Always be helpful and encouraging.\n"
-                    "6. Have a divinely guided intention!\n"
-                    "7. Be a good friend to the user and help them with their creative needs."
-                )
-            }
-        ]
-
-    history = conversation_histories[username]
-    
-    # Check for service keywords in user's message
-    for service_id in BUSINESS_LINKS:
-        if should_suggest_service(message, service_id):
-            # Add a subtle suggestion to the system message
-            history.insert(1, {
-                "role": "system",
-                "content": f"User mentioned keywords related to {service_id}. Consider suggesting [LINK:{service_id}]"
-            })
+    Items run in the bulk scheduler lane, so a large batch only gets the
+    upstream slots that interactive chats leave over.
+    """
+    app = request.app
+    lane = lane_for(username, request.headers.get("X-Priority"), BULK)
+    limit = asyncio.Semaphore(CHAT_BATCH_CONCURRENCY)
 
-    # Add user's message to history
-    history.append({"role": "user", "content": message})
+    async def run(index: int, prompt: str) -> dict:
+        async with limit:
+            try:
+                reply = await one_shot(app, username, prompt, lane)
+            except HTTPException as e:
+                return {"index": index, "status": e.status_code, "error": e.detail}
+            except Exception as e:
+                logger.exception("Batch item %d failed: %s", index, e)
+                return {"index": index, "status": 500, "error": "Internal error"}
+            return {"index": index, "status": 200, "reply": reply}
 
-    # Call Llama API
+    async def results():
+        tasks = [asyncio.ensure_future(run(i, p)) for i, p in enumerate(body.prompts)]
+        metrics.inc("chat.batch_items", len(tasks))
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield dumps(await next_done) + b"\n"
+        finally:
+            # Client went away: items not yet sent upstream are skipped.
+            # Calls already running cannot be aborted; they finish on their
+            # pool thread and keep their scheduler slot until then
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+async def one_shot(app: FastAPI, username: str, prompt: str, lane: str = BULK) -> str:
+    """
+    Answer a single prompt without conversation history.
+
+    Args:
+        app: The running application (holds the Llama API client)
+        username: Authenticated user (for budgets and usage)
+        prompt: The prompt text
+        lane: Scheduler lane for the upstream call
+    Returns:
+        str: The reply with business links rendered
+    """
+    catalog = catalogs.current
+    user_message = Message(USER, prompt)
+    messages = [catalog.system_prompt]
+    messages.extend(catalog.hints[s] for s in reversed(catalog.match_services(prompt)))
+    messages.append(user_message)
+
+    if not usage_tracker.within_budget(username, estimate_tokens(messages)):
+        raise HTTPException(status_code=429, detail="Daily token budget exceeded")
+    reply = await first_turn_reply(app, username, prompt, messages, catalog, lane)
+    return process_business_links(reply, catalog)
+
+async def complete(app: FastAPI, username: str, messages: list, lane: str = INTERACTIVE) -> str:
+    """
+    Send messages to the Llama API in the given scheduler lane, record the
+    token usage and return the reply text.
+    Raises HTTPException(500) when the call fails or the response has no reply.
+    """
     try:
-        llama_response = requests.post(
-            "https://api.llama.com/v1/chat/completions",
-            headers={
-                "Authorization": f"Bearer {LLAMA_API_KEY}",
-                "Content-Type": "application/json",
-            },
-            json={
-                "model": "Llama-4-Maverick-17B-128E-Instruct-FP8",
-                "messages": history
-            }
-        )
-        llama_response.raise_for_status()
-    except requests.exceptions.RequestException as e:
-        print(f"Llama API error: {e} {llama_response.text if 'llama_response' in locals() else ''}")
+        with span("upstream"):
+            data = await app.state.llama.chat(message_encoder.chat_body(LLAMA_MODEL, messages), lane=lane)
+    except UpstreamError as e:
+        logger.error("Llama API error: %s", e, extra={"fields": {"response_text": e.response_text[:2000]}})
         raise HTTPException(status_code=500, detail="Llama API failed")
 
     # Process the response
-    data = llama_response.json()
-    reply = data.get("completion_message", {}).get("content", {}).get("text")
+    reply = reply_text(data)
     if not reply:
         raise HTTPException(status_code=500, detail="Invalid response from Llama API")
 
+    # Record token usage (in memory only; flushed to SQLite in batches)
+    usage = usage_from_response(data)
+    if usage is None:
+        usage = (estimate_tokens(messages), estimate_tokens([Message(ASSISTANT, reply)]))
+    usage_tracker.record(username, *usage)
+    return reply
+
+async def first_turn_reply(app: FastAPI, username: str, prompt: str, messages: list, catalog, lane: str) -> str:
+    """
+    complete() for a prompt with no conversation before it. When the
+    semantic cache is enabled, a near-duplicate of a recent prompt is
+    answered with that prompt's reply instead of an upstream call.
+
+    Args:
+        app: The running application (holds the Llama API client)
+        username: Authenticated user
+        prompt: The user's prompt text
+        messages: Full message list to send upstream on a miss
+        catalog: The business catalog the request started with
+        lane: Scheduler lane for the upstream call
+    Returns:
+        str: The raw reply (business links not rendered yet)
+    """
+    if not semantic_cache.enabled:
+        return await complete(app, username, messages, lane)
+
+    with span("semantic_cache"):
+        # Embedded once; the same embedding indexes the reply on a miss
+        embedding = semantic_cache.embed(prompt)
+        entry = semantic_cache.lookup(embedding, catalog.version)
+    if entry is not None:
+        if semantic_cache.should_verify():
+            # Re-ask in the background lane, outside the user's budget
+            body = message_encoder.chat_body(LLAMA_MODEL, list(messages))
+
+            async def fresh_reply():
+                data = await app.state.llama.chat(body, lane=BACKGROUND)
+                return reply_text(data)
+
+            semantic_cache.verify(entry, fresh_reply)
+        return entry.reply
+
+    reply = await complete(app, username, messages, lane)
+    semantic_cache.store(embedding, catalog.version, reply)
+    return reply
+
+async def chat_turn(app: FastAPI, username: str, message: str, timings: dict = None, lane: str = INTERACTIVE) -> dict:
+    """
+    Run one chat exchange for a user: update history, call the Llama API,
+    record usage and save the turn.
+
+    Args:
+        app: The running application (holds the Llama API client)
+        username: Authenticated user
+        message: The user's message
+        timings: Optional dict filled with history_messages, upstream_ms
+            and reply_chars for the traffic recorder
+        lane: Scheduler lane for the upstream call
+    Returns:
+        dict: {"reply": ...} response body
+    """
+    user_message = Message(USER, message)
+    # One catalog for the whole turn, even if a reload lands meanwhile
+    catalog = catalogs.current
+
+    # Initialize or get user's conversation history
+    with span("history"):
+        history = conversation_histories.get(username)
+        if history is None:
+            # New to this worker (or after a restart): pick up where the saved
+            # conversation left off
+            restored = await asyncio.to_thread(recent_messages, username, HISTORY_RESTORE_MESSAGES)
+            history = conversation_histories.get(username)
+            if history is None:
+                history = [catalog.system_prompt, *restored]
+                conversation_histories.set(username, history)
+        elif history and history[0] is not catalog.system_prompt and history[0].role == SYSTEM:
+            # The catalog was reloaded since this history was started
+            history[0] = catalog.system_prompt
+
+    # Enforce the daily token budget before spending anything upstream
+    estimated_prompt_tokens = estimate_tokens(history) + estimate_tokens([user_message])
+    if not usage_tracker.within_budget(username, estimated_prompt_tokens):
+        raise HTTPException(status_code=429, detail="Daily token budget exceeded")
+    
+    # Check for service keywords in user's message
+    matched = catalog.match_services(message)
+    if matched:
+        # Hints sit in the leading block of system messages, which the
+        # summarizer never compacts, so each one is only added once
+        leading = set()
+        for m in history:
+            if m.role != SYSTEM:
+                break
+            leading.add(m)
+        for service_id in matched:
+            hint = catalog.hints[service_id]
+            if hint not in leading:
+                # Add a subtle suggestion to the system message
+                history.insert(1, hint)
+
+    # Nothing but system messages so far: the reply depends only on this message
+    first_turn = all(m.role == SYSTEM for m in history)
+
+    # Add user's message to history
+    history.append(user_message)
+    if timings is not None:
+        timings["history_messages"] = len(history)
+
+    # Call Llama API
+    upstream_started = time.perf_counter()
+    if first_turn:
+        reply = await first_turn_reply(app, username, message, history, catalog, lane)
+    else:
+        reply = await complete(app, username, history, lane)
+    upstream_ms = (time.perf_counter() - upstream_started) * 1000
+    if timings is not None:
+        timings["upstream_ms"] = upstream_ms
+        timings["reply_chars"] = len(reply)
+
     # Process any business links in the reply
-    reply = process_business_links(reply)
+    with span("links"):
+        reply = process_business_links(reply, catalog)
+
+    # Add AI's response to history and return. Saving the turn and
+    # analytics happen on the work queue after the response is sent.
+    assistant_message = Message(ASSISTANT, reply)
+    history.append(assistant_message)
+    summarizer.note(username, estimated_prompt_tokens + estimate_tokens([assistant_message]))
+    with span("persist"):
+        await work_queue.submit("messages", (username, [user_message, assistant_message]))
+    work_queue.offer("chat_events", {
+        "upstream_ms": upstream_ms,
+        "history_messages": len(history),
+        "reply_chars": len(reply),
+    })
+    return {"reply": reply}
 
-    # Add AI's response to history and return
-    history.append({"role": "assistant", "content": reply})
-    return {"reply": reply}
\ No newline at end of file
+app = create_app()
\ No newline at end of file
@@ -0,0 +1,116 @@
+import asyncio
+import cProfile
+import collections
+import marshal
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+from metrics import metrics
+
+# Longest profile an admin can ask for, in seconds
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+# Seconds between stack samples for collapsed-stack profiles
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))
+
+
+class ProfilerBusy(Exception):
+    """Another profile is already running in this worker."""
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class Profiler:
+    """
+    On-demand profiling of a live worker.
+
+    Nothing is installed until an admin asks for a profile, and everything
+    is removed when it ends, so an idle worker pays no overhead. Only one
+    profile runs at a time.
+
+    - cpu_collapsed(): samples every thread's stack and returns collapsed
+      stacks ("frame;frame;frame count" lines, the flame graph input format).
+    - cpu_pstats(): runs cProfile on the event-loop thread, where every
+      async handler runs, and returns a file pstats.Stats can load.
+    - allocations(): traces allocations with tracemalloc and reports the
+      source lines holding the most memory at the end.
+    """
+
+    def __init__(self):
+        self._lock = asyncio.Lock()
+
+    async def _exclusive(self, coro):
+        if self._lock.locked():
+            coro.close()
+            raise ProfilerBusy("A profile is already running")
+        async with self._lock:
+            metrics.inc("profiling.runs")
+            return await coro
+
+    async def cpu_collapsed(self, seconds: float, interval: float = PROFILE_SAMPLE_INTERVAL) -> str:
+        return await self._exclusive(asyncio.to_thread(self._sample, seconds, interval))
+
+    def _sample(self, seconds: float, interval: float) -> str:
+        stacks = collections.Counter()
+        me = threading.get_ident()
+        names = {}
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            time.sleep(interval)
+            names.update((t.ident, t.name) for t in threading.enumerate())
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                parts = []
+                while frame is not None:
+                    parts.append(_frame_name(frame))
+                    frame = frame.f_back
+                parts.append(names.get(ident, str(ident)))
+                stacks[";".join(reversed(parts))] += 1
+        return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+    async def cpu_pstats(self, seconds: float) -> bytes:
+        return await self._exclusive(self._run_cprofile(seconds))
+
+    async def _run_cprofile(self, seconds: float) -> bytes:
+        # Enabled from a coroutine, so it profiles the event-loop thread
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profile.disable()
+        profile.create_stats()
+        # The same bytes Profile.dump_stats() would write to a file
+        return marshal.dumps(profile.stats)
+
+    async def allocations(self, seconds: float, top: int = 25) -> list:
+        return await self._exclusive(self._trace_allocations(seconds, top))
+
+    async def _trace_allocations(self, seconds: float, top: int) -> list:
+        already_tracing = tracemalloc.is_tracing()
+        if not already_tracing:
+            tracemalloc.start()
+        try:
+            await asyncio.sleep(seconds)
+            snapshot = tracemalloc.take_snapshot()
+        finally:
+            if not already_tracing:
+                tracemalloc.stop()
+        snapshot = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+        return [
+            {
+                "where": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                "size_kb": round(stat.size / 1024, 1),
+                "count": stat.count,
+            }
+            for stat in snapshot.statistics("lineno")[:top]
+        ]
+
+
+profiler = Profiler()
@@ -0,0 +1,278 @@
+import asyncio
+import logging
+import math
+import os
+import random
+import re
+import zlib
+from collections import OrderedDict
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Answer near-duplicate first-turn prompts from recent replies (off by default:
+# cached replies are shared between users)
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "false").lower() == "true"
+# Cosine similarity of two prompts' n-gram vectors needed to reuse a reply
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.8"))
+# Cached prompts kept (least recently used go first), and the longest reply worth caching
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "2000"))
+SEMANTIC_CACHE_MAX_REPLY_CHARS = int(os.getenv("SEMANTIC_CACHE_MAX_REPLY_CHARS", "8000"))
+# Random-hyperplane LSH: hash tables, and hyperplanes (signature bits) per table
+SEMANTIC_CACHE_TABLES = int(os.getenv("SEMANTIC_CACHE_TABLES", "10"))
+SEMANTIC_CACHE_BITS = int(os.getenv("SEMANTIC_CACHE_BITS", "8"))
+# Least certain signature bits flipped per table on lookup (multi-probe LSH)
+SEMANTIC_CACHE_PROBES = int(os.getenv("SEMANTIC_CACHE_PROBES", "2"))
+# Share of hits also sent upstream in the background to check the cached reply
+SEMANTIC_CACHE_VERIFY_RATE = float(os.getenv("SEMANTIC_CACHE_VERIFY_RATE", "0.02"))
+# A checked hit whose fresh reply is less similar than this to the cached one counts as false
+SEMANTIC_CACHE_VERIFY_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_VERIFY_THRESHOLD", "0.35"))
+
+# Hashed feature space of prompt vectors
+DIMENSIONS = 1024
+
+# Words too common in prompts to say anything about what is being asked
+STOPWORDS = frozenset(
+    "a an the i im me my we our you your it its this that these those is are was be been am "
+    "do does did can could would should will shall may might must how what which who whom "
+    "where when why to of for in on at by from with about into and or but if so some any "
+    "please help want need like get just"
+    .split()
+)
+
+_WORD = re.compile(r"[a-z0-9]+")
+_NUMBER = re.compile(r"\d+(?:\.\d+)?")
+
+
+def _add(vector: dict, feature: str, weight: float):
+    h = zlib.crc32(feature.encode())
+    # The top hash bit picks the sign so colliding features tend to cancel out
+    vector[h % DIMENSIONS] = vector.get(h % DIMENSIONS, 0.0) + (weight if h >> 31 else -weight)
+
+
+def vectorize(text: str) -> dict:
+    """
+    Sparse unit vector ({dimension: weight}) of a prompt's hashed words,
+    word pairs and character trigrams. Stopwords and one-letter words are
+    dropped; trigrams let "shirts" and "t-shirts" or "print" and
+    "printing" still overlap.
+    """
+    words = [w for w in _WORD.findall(text.lower()) if len(w) > 1 and w not in STOPWORDS]
+    vector = {}
+    for word in words:
+        _add(vector, "w:" + word, 1.0)
+        padded = f"#{word}#"
+        for i in range(len(padded) - 2):
+            _add(vector, "c:" + padded[i:i + 3], 0.3)
+    for first, second in zip(words, words[1:]):
+        _add(vector, f"b:{first} {second}", 0.5)
+    norm = math.sqrt(sum(w * w for w in vector.values()))
+    return {d: w / norm for d, w in vector.items()} if norm else {}
+
+
+def similarity(a: dict, b: dict) -> float:
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(w * b.get(d, 0.0) for d, w in a.items())
+
+
+class Embedding:
+    """A prompt as the cache sees it: its vector, the numbers it mentions and its per-table hyperplane projections."""
+
+    __slots__ = ("vector", "numbers", "projections")
+
+    def __init__(self, vector, numbers, projections):
+        self.vector = vector
+        self.numbers = numbers
+        self.projections = projections
+
+
+class _Entry:
+    __slots__ = ("key", "vector", "numbers", "version", "reply", "signatures")
+
+    def __init__(self, key, vector, numbers, version, reply, signatures):
+        self.key = key
+        self.vector = vector
+        self.numbers = numbers
+        self.version = version
+        self.reply = reply
+        self.signatures = signatures
+
+
+class SemanticCache:
+    """
+    In-memory cache of replies to first-turn prompts, matched by meaning
+    rather than exact text.
+
+    Prompts are embedded once with embed() (vectorize() plus the
+    projections below), and the same Embedding is passed to lookup() and,
+    on a miss, to store(). Entries are indexed by random-hyperplane
+    LSH: each of `tables` tables buckets a prompt by the signs of its
+    projections onto `bits` fixed random hyperplanes, so prompts at a small
+    angle usually share a bucket in at least one table. Lookups also probe
+    the neighbouring buckets reached by flipping the `probes` bits whose
+    projections were closest to zero, which raises recall near the
+    threshold without more tables. Candidates from
+    those buckets are then checked exactly, and the most similar one at or
+    above the threshold is a hit, provided it was answered under the same
+    catalog version and mentions the same numbers ("50 shirts" and "500
+    shirts" are near-identical vectors but different questions).
+
+    Memory is bounded by max_entries (least recently used are evicted) and
+    by not caching replies over max_reply_chars. A sample of hits is
+    re-asked upstream in the background (see verify()); a fresh reply that
+    differs too much from the cached one is counted as a false hit and the
+    entry is dropped.
+    """
+
+    def __init__(self, enabled: bool = SEMANTIC_CACHE_ENABLED, threshold: float = SEMANTIC_CACHE_THRESHOLD,
+                 max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES, max_reply_chars: int = SEMANTIC_CACHE_MAX_REPLY_CHARS,
+                 tables: int = SEMANTIC_CACHE_TABLES, bits: int = SEMANTIC_CACHE_BITS,
+                 probes: int = SEMANTIC_CACHE_PROBES, seed: int = 0):
+        self.enabled = enabled
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.max_reply_chars = max_reply_chars
+        self.tables = tables
+        self.bits = bits
+        self.probes = min(probes, bits)
+        rng = random.Random(seed)
+        # planes[d][j]: component d of hyperplane j (tables * bits of them)
+        self._planes = [[rng.gauss(0, 1) for _ in range(tables * bits)] for _ in range(DIMENSIONS)] if enabled else []
+        self._buckets = [{} for _ in range(tables)]
+        self._entries = OrderedDict()
+        self._next_key = 0
+        self._verifying = set()
+
+    def _projections(self, vector: dict) -> list:
+        projections = [0.0] * (self.tables * self.bits)
+        for d, w in vector.items():
+            plane = self._planes[d]
+            for j in range(len(projections)):
+                projections[j] += w * plane[j]
+        return [projections[t * self.bits:(t + 1) * self.bits] for t in range(self.tables)]
+
+    @staticmethod
+    def _signature(projections: list) -> int:
+        signature = 0
+        for p in projections:
+            signature = (signature << 1) | (p > 0)
+        return signature
+
+    def _probe(self, projections: list) -> list:
+        # The exact bucket, then the ones one uncertain bit away
+        signature = self._signature(projections)
+        uncertain = sorted(range(self.bits), key=lambda i: abs(projections[i]))[:self.probes]
+        return [signature, *(signature ^ (1 << (self.bits - 1 - i)) for i in uncertain)]
+
+    def embed(self, prompt: str):
+        """
+        Embed a prompt for lookup() and store(), or return None if it has
+        no words worth matching on (or the cache is disabled).
+        """
+        if not self.enabled:
+            return None
+        vector = vectorize(prompt)
+        if not vector:
+            return None
+        return Embedding(vector, frozenset(_NUMBER.findall(prompt)), self._projections(vector))
+
+    def lookup(self, embedding: Embedding, version):
+        """
+        Return the cached entry for the closest earlier prompt, or None.
+        The reply is in entry.reply.
+        """
+        if not self.enabled:
+            return None
+        metrics.inc("semantic_cache.lookups")
+        if embedding is None:
+            metrics.inc("semantic_cache.misses")
+            return None
+        candidates = set()
+        for bucket, projections in zip(self._buckets, embedding.projections):
+            for signature in self._probe(projections):
+                candidates.update(bucket.get(signature, ()))
+        metrics.observe("semantic_cache.candidates", len(candidates))
+
+        best, best_score = None, self.threshold
+        for key in candidates:
+            entry = self._entries[key]
+            if entry.version != version or entry.numbers != embedding.numbers:
+                continue
+            score = similarity(embedding.vector, entry.vector)
+            if score >= best_score:
+                best, best_score = entry, score
+        if best is None:
+            metrics.inc("semantic_cache.misses")
+            return None
+        self._entries.move_to_end(best.key)
+        metrics.inc("semantic_cache.hits")
+        metrics.observe("semantic_cache.hit_similarity", best_score)
+        return best
+
+    def store(self, embedding: Embedding, version, reply: str):
+        if not self.enabled or embedding is None or len(reply) > self.max_reply_chars:
+            return
+        entry = _Entry(self._next_key, embedding.vector, embedding.numbers, version, reply,
+                       [self._signature(p) for p in embedding.projections])
+        self._next_key += 1
+        self._entries[entry.key] = entry
+        for bucket, signature in zip(self._buckets, entry.signatures):
+            bucket.setdefault(signature, set()).add(entry.key)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries.values())))
+            metrics.inc("semantic_cache.evictions")
+
+    def _remove(self, entry: _Entry):
+        if self._entries.pop(entry.key, None) is None:
+            return
+        for bucket, signature in zip(self._buckets, entry.signatures):
+            keys = bucket[signature]
+            keys.discard(entry.key)
+            if not keys:
+                del bucket[signature]
+
+    def should_verify(self) -> bool:
+        return random.random() < SEMANTIC_CACHE_VERIFY_RATE
+
+    def verify(self, entry: _Entry, fetch):
+        """
+        Shadow-check a hit in the background. fetch() is a coroutine
+        function returning a fresh reply to the prompt that hit (or None if
+        it could not get one); the caller already has the cached reply.
+        """
+        async def check():
+            try:
+                fresh = await fetch()
+            except Exception as e:
+                logger.debug("Semantic cache check failed: %s", e)
+                return
+            if not fresh:
+                return
+            metrics.inc("semantic_cache.verified")
+            if similarity(vectorize(fresh), vectorize(entry.reply)) < SEMANTIC_CACHE_VERIFY_THRESHOLD:
+                metrics.inc("semantic_cache.false_hits")
+                self._remove(entry)
+
+        task = asyncio.create_task(check())
+        # Keep a reference until it finishes so it is not garbage collected
+        self._verifying.add(task)
+        task.add_done_callback(self._verifying.discard)
+
+    def stats(self) -> dict:
+        lookups = metrics.counter("semantic_cache.lookups")
+        hits = metrics.counter("semantic_cache.hits")
+        verified = metrics.counter("semantic_cache.verified")
+        false_hits = metrics.counter("semantic_cache.false_hits")
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "reply_chars": sum(len(e.reply) for e in self._entries.values()),
+            "hit_rate": round(hits / lookups, 3) if lookups else None,
+            # Share of shadow-checked hits whose cached reply did not hold up
+            "false_hit_rate": round(false_hits / verified, 3) if verified else None,
+        }
+
+
+semantic_cache = SemanticCache()
@@ -0,0 +1,128 @@
+"""
+Bulk user provisioning, e.g. to onboard a partner community.
+
+Reads users from a CSV file (with a username,password header) or a JSONL
+file ({"username": ..., "password": ...} per line), hashes passwords
+across a process pool, checks which usernames already exist one batch at
+a time and inserts the new users with one transaction per batch.
+Usernames that already exist, or appear twice in the file, are skipped
+and reported.
+
+Usage (from backend/):
+    python provision_users.py partners.csv
+    python provision_users.py partners.jsonl --workers 8 --batch-size 1000 --duplicates-out dups.txt
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from sqlalchemy.dialects.sqlite import insert
+from sqlmodel import Session, select
+
+from auth import _bcrypt
+from db import get_engine, init_db
+from models import User
+
+
+def read_users(path: str):
+    """Yield (username, password) from a CSV or JSONL file."""
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.endswith((".jsonl", ".ndjson")):
+            rows = (json.loads(line) for line in f if line.strip())
+        else:
+            rows = csv.DictReader(f)
+        for row in rows:
+            yield row.get("username"), row.get("password")
+
+
+def hash_password(password: str) -> str:
+    return _bcrypt().hash(password)
+
+
+def batches(rows, size: int):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def provision(path: str, workers: int, batch_size: int, dry_run: bool = False) -> dict:
+    """Create every new user in path. Returns counts and the skipped usernames."""
+    report = {"read": 0, "created": 0, "existing": [], "duplicates": [], "invalid": 0}
+    seen = set()
+    started = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for batch in batches(read_users(path), batch_size):
+            report["read"] += len(batch)
+
+            users = {}
+            for username, password in batch:
+                username = (username or "").strip()
+                if not username or not password:
+                    report["invalid"] += 1
+                elif username in seen:
+                    report["duplicates"].append(username)
+                else:
+                    seen.add(username)
+                    users[username] = password
+
+            # One IN (...) query per batch instead of one lookup per user
+            with Session(get_engine()) as session:
+                existing = set(session.exec(select(User.username).where(User.username.in_(users))).all())
+            report["existing"].extend(sorted(existing))
+            new = [(u, p) for u, p in users.items() if u not in existing]
+            if not new or dry_run:
+                continue
+
+            hashes = pool.map(hash_password, [p for _, p in new], chunksize=max(1, len(new) // (workers * 4)))
+            rows = [{"username": u, "password_hash": h} for (u, _), h in zip(new, hashes)]
+            # DO NOTHING covers users created through /signup since the check above
+            stmt = insert(User).values(rows).on_conflict_do_nothing(index_elements=["username"])
+            with get_engine().begin() as conn:
+                report["created"] += conn.execute(stmt).rowcount
+
+            elapsed = time.perf_counter() - started
+            print(f"  {report['read']} read, {report['created']} created, "
+                  f"{report['created'] / elapsed:.0f} users/s", file=sys.stderr)
+
+    report["seconds"] = round(time.perf_counter() - started, 2)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("path", help="CSV (username,password header) or JSONL file")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Processes hashing passwords")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Users checked and inserted per transaction")
+    parser.add_argument("--dry-run", action="store_true", help="Report what would happen without writing")
+    parser.add_argument("--duplicates-out", help="Write skipped usernames to this file, one per line")
+    args = parser.parse_args()
+
+    get_engine().echo = False
+    init_db()
+    report = provision(args.path, args.workers, args.batch_size, args.dry_run)
+
+    skipped = report["existing"] + report["duplicates"]
+    rate = report["created"] / report["seconds"] if report["seconds"] else 0
+    print(f"Read {report['read']} rows in {report['seconds']}s: created {report['created']} "
+          f"({rate:.0f} users/s), {len(report['existing'])} already existed, "
+          f"{len(report['duplicates'])} duplicated in the file, {report['invalid']} invalid")
+    if args.duplicates_out:
+        with open(args.duplicates_out, "w", encoding="utf-8") as f:
+            f.writelines(f"{u}\n" for u in skipped)
+    elif skipped:
+        shown = ", ".join(skipped[:20])
+        print(f"Skipped: {shown}{' ...' if len(skipped) > 20 else ''}")
+
+
+if __name__ == "__main__":
+    main()
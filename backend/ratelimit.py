@@ -0,0 +1,247 @@
+import asyncio
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from auth import verify_token
+from metrics import metrics
+
+# Set to "false" to disable rate limiting entirely
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() != "false"
+# Optional SQLite file shared by all workers; in-process buckets when unset
+RATE_LIMIT_DB = os.getenv("RATE_LIMIT_DB")
+# Upper bound on in-memory buckets; least recently used ones are evicted first
+RATE_LIMIT_MAX_BUCKETS = int(os.getenv("RATE_LIMIT_MAX_BUCKETS", "100000"))
+
+
+class Policy:
+    """Token bucket settings: `rate` tokens refill per second, up to `burst` tokens."""
+
+    __slots__ = ("rate", "burst")
+
+    def __init__(self, per_minute: float, burst: int):
+        self.rate = per_minute / 60
+        self.burst = burst
+
+    @property
+    def idle_seconds(self) -> float:
+        # After this long without requests a bucket is full again, which is
+        # the same as not having a bucket at all
+        return self.burst / self.rate
+
+
+# Per-endpoint policies. "user" buckets are keyed by the username from the
+# verified JWT, "ip" buckets by the client address.
+POLICIES = {
+    "/chat": {"user": Policy(per_minute=20, burst=5), "ip": Policy(per_minute=60, burst=20)},
+    # Each batch carries up to CHAT_BATCH_MAX_ITEMS prompts
+    "/chat/batch": {"user": Policy(per_minute=6, burst=2), "ip": Policy(per_minute=20, burst=5)},
+    "/login": {"ip": Policy(per_minute=10, burst=5)},
+    "/signup": {"ip": Policy(per_minute=5, burst=3)},
+}
+
+
+class MemoryBuckets:
+    """
+    Token buckets in an LRU-ordered dict.
+
+    Each check is O(1): refill from the elapsed time, take a token, move the
+    bucket to the end. Buckets at the front that have been idle long enough
+    to be full are dropped, and the total is capped at max_buckets.
+    """
+
+    def __init__(self, max_buckets: int = RATE_LIMIT_MAX_BUCKETS):
+        self.max_buckets = max_buckets
+        self._buckets = OrderedDict()  # key -> [tokens, last_refill, idle_seconds]
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def take(self, key: str, policy: Policy, now: float = None):
+        """Take one token. Returns (allowed, retry_after_seconds)."""
+        rejected, retry_after = self.take_all([(key, policy)], now)
+        return rejected is None, retry_after
+
+    def take_all(self, checks: list, now: float = None):
+        """
+        Take one token from every (key, policy) bucket, or from none if any
+        is empty. Returns (rejected_key, retry_after_seconds); rejected_key
+        is None when the request is allowed.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            buckets = []
+            for key, policy in checks:
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    bucket = [policy.burst, now, policy.idle_seconds]
+                    self._buckets[key] = bucket
+                else:
+                    self._buckets.move_to_end(key)
+                    bucket[0] = min(policy.burst, bucket[0] + (now - bucket[1]) * policy.rate)
+                    bucket[1] = now
+                buckets.append(bucket)
+            self._evict(now)
+
+            for (key, policy), bucket in zip(checks, buckets):
+                if bucket[0] < 1:
+                    return key, (1 - bucket[0]) / policy.rate
+            for bucket in buckets:
+                bucket[0] -= 1
+            return None, 0.0
+
+    def _evict(self, now: float):
+        buckets = self._buckets
+        while buckets:
+            key, (_, last, idle) = next(iter(buckets.items()))
+            if len(buckets) > self.max_buckets or now - last > idle:
+                del buckets[key]
+            else:
+                break
+
+
+class SQLiteBuckets:
+    """
+    Token buckets in a SQLite file so limits hold across worker processes.
+
+    Each check is a single-row read-modify-write inside BEGIN IMMEDIATE.
+    Idle buckets are pruned every prune_every checks.
+    """
+
+    def __init__(self, path: str, prune_every: int = 1000):
+        self.path = path
+        self.prune_every = prune_every
+        self._checks = 0
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS rate_bucket ("
+            "key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL, expires REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_rate_bucket_expires ON rate_bucket (expires)")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def take(self, key: str, policy: Policy, now: float = None):
+        """Take one token. Returns (allowed, retry_after_seconds)."""
+        rejected, retry_after = self.take_all([(key, policy)], now)
+        return rejected is None, retry_after
+
+    def take_all(self, checks: list, now: float = None):
+        """Like MemoryBuckets.take_all, in one transaction."""
+        # Wall-clock time: the buckets are shared between processes
+        now = time.time() if now is None else now
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            levels = []
+            for key, policy in checks:
+                row = conn.execute("SELECT tokens, updated FROM rate_bucket WHERE key = ?", (key,)).fetchone()
+                levels.append(policy.burst if row is None else min(policy.burst, row[0] + (now - row[1]) * policy.rate))
+            rejected, retry_after = None, 0.0
+            for (key, policy), tokens in zip(checks, levels):
+                if tokens < 1:
+                    rejected, retry_after = key, (1 - tokens) / policy.rate
+                    break
+            for (key, policy), tokens in zip(checks, levels):
+                conn.execute(
+                    "INSERT INTO rate_bucket (key, tokens, updated, expires) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (key) DO UPDATE SET tokens = excluded.tokens, "
+                    "updated = excluded.updated, expires = excluded.expires",
+                    (key, tokens if rejected else tokens - 1, now, now + policy.idle_seconds),
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        self._checks += 1
+        if self._checks % self.prune_every == 0:
+            self.prune(now)
+        return rejected, retry_after
+
+    def prune(self, now: float = None):
+        now = time.time() if now is None else now
+        self._conn().execute("DELETE FROM rate_bucket WHERE expires < ?", (now,))
+
+
+class RateLimitMiddleware:
+    """
+    ASGI middleware applying POLICIES per endpoint, per user and per client IP.
+
+    The client IP comes from the ASGI scope; run uvicorn with --proxy-headers
+    behind a load balancer so it reflects X-Forwarded-For. A verified
+    username is left in request.state so get_current_user does not decode
+    the token twice.
+    """
+
+    def __init__(self, app, policies: dict = None, backend=None):
+        self.app = app
+        self.policies = POLICIES if policies is None else policies
+        if backend is None:
+            backend = SQLiteBuckets(RATE_LIMIT_DB) if RATE_LIMIT_DB else MemoryBuckets()
+        self.backend = backend
+        self._shared = isinstance(backend, SQLiteBuckets)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not RATE_LIMIT_ENABLED:
+            return await self.app(scope, receive, send)
+        policies = self.policies.get(scope["path"])
+        if policies is None:
+            return await self.app(scope, receive, send)
+
+        path = scope["path"]
+        checks = []
+        if "ip" in policies and scope.get("client"):
+            checks.append((f"ip:{scope['client'][0]}:{path}", policies["ip"]))
+        if "user" in policies:
+            username = self._username(scope)
+            if username:
+                scope.setdefault("state", {})["username"] = username
+                checks.append((f"user:{username}:{path}", policies["user"]))
+
+        if checks:
+            # All or nothing: a request one bucket rejects costs the others nothing
+            if self._shared:
+                rejected, retry_after = await asyncio.to_thread(self.backend.take_all, checks)
+            else:
+                rejected, retry_after = self.backend.take_all(checks)
+            if rejected is not None:
+                metrics.inc(f"ratelimit.rejected.{rejected.split(':', 1)[0]}")
+                return await self._reject(send, retry_after)
+
+        return await self.app(scope, receive, send)
+
+    @staticmethod
+    def _username(scope):
+        for name, value in scope.get("headers", ()):
+            if name == b"authorization":
+                value = value.decode("latin-1")
+                if value.startswith("Bearer "):
+                    return verify_token(value.split(" ")[1])
+        return None
+
+    @staticmethod
+    async def _reject(send, retry_after: float):
+        body = json.dumps({"detail": "Too many requests"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(math.ceil(retry_after)).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
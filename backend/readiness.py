@@ -0,0 +1,94 @@
+import asyncio
+import os
+import time
+
+from db import get_engine, _schema_version, SCHEMA_VERSION
+from drain import drain
+from loopmonitor import loop_monitor
+from metrics import metrics
+from tasks import work_queue
+
+# Seconds a readiness result is reused, so frequent health checks cost nothing
+READY_CACHE_TTL = float(os.getenv("READY_CACHE_TTL", "2"))
+# Seconds the database probe may take before the worker is reported unready
+READY_DB_TIMEOUT = float(os.getenv("READY_DB_TIMEOUT", "1"))
+# Event-loop lag (ms) above which the worker is reported unready
+READY_MAX_LOOP_LAG_MS = float(os.getenv("READY_MAX_LOOP_LAG_MS", "500"))
+# Share of the work queue that may be filled before the worker is reported unready
+READY_MAX_QUEUE_FILL = float(os.getenv("READY_MAX_QUEUE_FILL", "0.9"))
+
+
+def _probe_db() -> int:
+    # Reading the schema version needs a shared lock on the database file,
+    # so it fails (after the busy timeout) while another connection holds
+    # it exclusively, unlike a bare SELECT 1
+    with get_engine().connect() as conn:
+        return _schema_version(conn)
+
+
+class Readiness:
+    """
+    Cached deep health check behind GET /ready.
+
+    One probe looks at the database, the work queue and event-loop lag,
+    and reports the upstream circuit state. Its result is kept for ttl
+    seconds and concurrent callers share the probe in progress, so a load
+    balancer polling every few hundred milliseconds adds no database or
+    upstream load.
+    """
+
+    def __init__(self, ttl: float = READY_CACHE_TTL):
+        self.ttl = ttl
+        self._result = None
+        self._expires = 0.0
+        self._probing = None
+
+    async def check(self, app) -> dict:
+        if self._result is not None and time.monotonic() < self._expires:
+            return self._result
+        if self._probing is None:
+            self._probing = asyncio.ensure_future(self._probe(app))
+        probing = self._probing
+        try:
+            return await asyncio.shield(probing)
+        finally:
+            if probing.done() and self._probing is probing:
+                self._probing = None
+
+    async def _probe(self, app) -> dict:
+        metrics.inc("ready.probes")
+        checks = {}
+
+        started = time.perf_counter()
+        try:
+            version = await asyncio.wait_for(asyncio.to_thread(_probe_db), READY_DB_TIMEOUT)
+            checks["db"] = {"ok": version >= SCHEMA_VERSION, "schema_version": version}
+        except Exception as e:
+            checks["db"] = {"ok": False, "error": str(e) or type(e).__name__}
+        checks["db"]["ms"] = round((time.perf_counter() - started) * 1000, 2)
+
+        llama = getattr(app.state, "llama", None)
+        # Reported, but never fails the check: every worker shares the same
+        # upstream, so an open circuit would mark them all unready at once
+        # and leave the load balancer nowhere to route
+        circuit = llama.circuit_state() if llama is not None else "missing"
+        checks["upstream"] = {"ok": True, "circuit": circuit}
+
+        depth, capacity = work_queue.depth(), work_queue.capacity()
+        checks["queue"] = {
+            "ok": capacity <= 0 or depth < capacity * READY_MAX_QUEUE_FILL,
+            "depth": depth,
+            "capacity": capacity,
+        }
+
+        lag_ms = loop_monitor.lag_ms
+        checks["event_loop"] = {"ok": lag_ms < READY_MAX_LOOP_LAG_MS, "lag_ms": round(lag_ms, 2)}
+
+        checks["drain"] = {"ok": not drain.draining, "inflight": drain.inflight}
+
+        ready = all(check["ok"] for check in checks.values())
+        if not ready:
+            metrics.inc("ready.failed")
+        self._result = {"ready": ready, "checks": checks}
+        self._expires = time.monotonic() + self.ttl
+        return self._result
@@ -0,0 +1,160 @@
+import asyncio
+import contextlib
+import logging
+import os
+import time
+
+from metrics import metrics
+from settings import parse_pairs
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+BACKGROUND = "background"
+# Highest priority first; clients may only ask for a lane later in this list
+LANES = [INTERACTIVE, BULK, BACKGROUND]
+
+# Relative share of upstream slots each lane gets while lanes compete
+SCHEDULER_WEIGHTS = os.getenv("SCHEDULER_WEIGHTS", "interactive:8,bulk:2,background:1")
+# Slots held back for each lane so the others can never take all of them
+SCHEDULER_FLOORS = os.getenv("SCHEDULER_FLOORS", "interactive:4,bulk:1,background:0")
+# Accounts whose tokens always map to a lane, e.g. "nightly-export:bulk"
+SCHEDULER_USER_LANES = os.getenv("SCHEDULER_USER_LANES", "")
+
+_user_lanes = {user: lane for user, lane in parse_pairs(SCHEDULER_USER_LANES).items() if lane in LANES}
+
+
+def lane_for(username: str, requested: str = None, default: str = INTERACTIVE) -> str:
+    """
+    Pick the scheduler lane for a request.
+
+    Args:
+        username: Authenticated user; accounts in SCHEDULER_USER_LANES are pinned to their lane
+        requested: Lane the client asked for (X-Priority header), if any
+        default: Lane of the endpoint (interactive for /chat, bulk for /chat/batch)
+    Returns:
+        str: The lane. A client can move itself to a lower priority lane, never a higher one.
+    """
+    lane = _user_lanes.get(username, default)
+    if requested in LANES and LANES.index(requested) > LANES.index(lane):
+        lane = requested
+    return lane
+
+
+class _Lane:
+    __slots__ = ("name", "weight", "floor", "in_use", "waiters", "finish")
+
+    def __init__(self, name: str, weight: float, floor: int):
+        self.name = name
+        self.weight = weight
+        self.floor = floor
+        self.in_use = 0
+        self.waiters = []
+        # Virtual time at which this lane's last granted slot "finishes"
+        self.finish = 0.0
+
+
+class Scheduler:
+    """
+    Weighted fair admission to a fixed number of upstream slots.
+
+    Every call takes a slot in one of LANES for as long as it runs. When
+    slots are short, waiting lanes are served by start-time fair queuing:
+    each grant advances the lane's virtual clock by 1/weight and the lane
+    with the earliest clock goes next, so interactive chats get weight-
+    proportional turns even behind a deep bulk backlog. On top of that, a
+    lane's floor is held back from the other lanes: a slot is only handed
+    out if the floors still unmet by other lanes fit in what remains. A
+    floor is reserved even while its lane is idle, which is what keeps a
+    chat from ever waiting behind a full house of batch calls.
+    """
+
+    def __init__(self, capacity: int, weights: dict = None, floors: dict = None):
+        weights = weights if weights is not None else parse_pairs(SCHEDULER_WEIGHTS, float)
+        floors = floors if floors is not None else parse_pairs(SCHEDULER_FLOORS, int)
+        self.capacity = capacity
+        self._lanes = {}
+        unreserved = capacity
+        for name in LANES:
+            floor = max(0, min(floors.get(name, 0), unreserved))
+            if floor < floors.get(name, 0):
+                logger.warning("Scheduler floor for %s lowered to %d to fit %d slots", name, floor, capacity)
+            unreserved -= floor
+            self._lanes[name] = _Lane(name, max(weights.get(name, 1.0), 0.001), floor)
+        self._free = capacity
+        self._vtime = 0.0
+
+    def _admissible(self, lane: _Lane) -> bool:
+        if self._free <= 0:
+            return False
+        reserved = sum(max(0, other.floor - other.in_use) for other in self._lanes.values() if other is not lane)
+        return self._free - 1 >= reserved
+
+    def _grant(self, lane: _Lane):
+        start = max(lane.finish, self._vtime)
+        self._vtime = start
+        lane.finish = start + 1 / lane.weight
+        lane.in_use += 1
+        self._free -= 1
+
+    def _dispatch(self):
+        while True:
+            ready = [lane for lane in self._lanes.values() if lane.waiters and self._admissible(lane)]
+            if not ready:
+                return
+            lane = min(ready, key=lambda l: max(l.finish, self._vtime))
+            waiter = lane.waiters.pop(0)
+            if waiter.done():
+                continue
+            self._grant(lane)
+            waiter.set_result(None)
+
+    async def acquire(self, lane_name: str):
+        lane = self._lanes[lane_name]
+        started = time.perf_counter()
+        if not lane.waiters and self._admissible(lane):
+            self._grant(lane)
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            lane.waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # Granted just as the caller gave up: hand the slot on
+                    self.release(lane_name)
+                elif waiter in lane.waiters:
+                    lane.waiters.remove(waiter)
+                raise
+        metrics.observe(f"scheduler.{lane_name}.wait_ms", (time.perf_counter() - started) * 1000)
+
+    def release(self, lane_name: str):
+        lane = self._lanes[lane_name]
+        lane.in_use -= 1
+        self._free += 1
+        self._dispatch()
+
+    @contextlib.asynccontextmanager
+    async def slot(self, lane_name: str):
+        """Hold an upstream slot in the given lane for the duration of the block."""
+        await self.acquire(lane_name)
+        try:
+            yield
+        finally:
+            self.release(lane_name)
+
+    def stats(self) -> dict:
+        return {
+            "capacity": self.capacity,
+            "free": self._free,
+            "lanes": {
+                name: {
+                    "weight": lane.weight,
+                    "floor": lane.floor,
+                    "in_use": lane.in_use,
+                    "waiting": len(lane.waiters),
+                }
+                for name, lane in self._lanes.items()
+            },
+        }
@@ -0,0 +1,74 @@
+import json
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # optional: the stdlib json module is always available
+    orjson = None
+
+# Which JSON library is in use, for /metrics and benchmarks
+JSON_BACKEND = "orjson" if orjson is not None else "json"
+
+
+if orjson is not None:
+    def dumps(obj) -> bytes:
+        """Encode obj as compact UTF-8 JSON bytes."""
+        return orjson.dumps(obj)
+
+    def loads(data):
+        """Decode JSON from bytes or str."""
+        return orjson.loads(data)
+else:
+    _encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+    def dumps(obj) -> bytes:
+        """Encode obj as compact UTF-8 JSON bytes."""
+        return _encoder.encode(obj).encode()
+
+    def loads(data):
+        """Decode JSON from bytes or str."""
+        return json.loads(data)
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with the serializer above; the app's default response class."""
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+class MessageEncoder:
+    """
+    Builds upstream chat request bodies from Message objects.
+
+    Messages registered with pin() (the system prompt and keyword hints,
+    which start every request) are encoded once and their bytes reused;
+    only the conversation's own messages are encoded per request.
+    """
+
+    def __init__(self):
+        self._pinned = {}  # id(message) -> (message, encoded bytes)
+
+    def pin(self, message):
+        # Keep the message itself so its id cannot be reused by another object
+        self._pinned[id(message)] = (message, dumps(message.to_dict()))
+
+    def unpin(self, message):
+        self._pinned.pop(id(message), None)
+
+    def encode(self, message) -> bytes:
+        entry = self._pinned.get(id(message))
+        if entry is not None:
+            return entry[1]
+        return dumps(message.to_dict())
+
+    def chat_body(self, model: str, messages) -> bytes:
+        """The JSON body {"model": ..., "messages": [...]} as bytes."""
+        return b"".join((
+            b'{"model":', dumps(model),
+            b',"messages":[', b",".join(self.encode(m) for m in messages), b"]}",
+        ))
+
+
+message_encoder = MessageEncoder()
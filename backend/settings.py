@@ -0,0 +1,18 @@
+def parse_pairs(raw: str, cast=str) -> dict:
+    """
+    Parse a "name:value,name:value" setting into a dict.
+
+    Args:
+        raw: The setting as read from the environment
+        cast: Applied to each value (e.g. int for token budgets)
+    Returns:
+        dict: name -> value. Items without a colon are skipped, and the
+        name is everything before the last colon.
+    """
+    pairs = {}
+    for item in raw.split(","):
+        if ":" not in item:
+            continue
+        name, value = item.rsplit(":", 1)
+        pairs[name.strip()] = cast(value.strip())
+    return pairs
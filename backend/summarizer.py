@@ -0,0 +1,141 @@
+import asyncio
+import logging
+import os
+
+from messages import Message, SYSTEM, USER, ASSISTANT
+from metrics import metrics
+from scheduler import BACKGROUND
+from upstream import UpstreamError, LLAMA_MODEL, reply_text
+from usage import estimate_tokens, usage_from_response, usage_tracker
+
+logger = logging.getLogger(__name__)
+
+# Summarize a history once its estimated size passes this many tokens
+SUMMARY_THRESHOLD_TOKENS = int(os.getenv("SUMMARY_THRESHOLD_TOKENS", "6000"))
+# Most recent user/assistant messages that are always kept verbatim
+SUMMARY_KEEP_RECENT = int(os.getenv("SUMMARY_KEEP_RECENT", "6"))
+# Seconds between summarizer passes, and users handled per pass
+SUMMARY_INTERVAL = float(os.getenv("SUMMARY_INTERVAL", "10"))
+SUMMARY_BATCH = int(os.getenv("SUMMARY_BATCH", "4"))
+# Only summarize while fewer than this many interactive chats are in flight
+SUMMARY_MAX_INTERACTIVE = int(os.getenv("SUMMARY_MAX_INTERACTIVE", "4"))
+
+SUMMARY_PREFIX = "Summary of the earlier conversation:\n"
+
+SUMMARY_INSTRUCTIONS = Message(
+    SYSTEM,
+    "Summarize the conversation below between a user and MuseMate, a creative assistant. "
+    "Keep the user's projects, names, preferences, decisions and open questions. "
+    "Write at most 200 words in plain prose, no preamble."
+)
+
+
+def is_summary(message: Message) -> bool:
+    return message.role == SYSTEM and message.content.startswith(SUMMARY_PREFIX)
+
+
+class Summarizer:
+    """
+    Background compaction of long conversation histories.
+
+    chat_turn() calls note() with each history's estimated size, which only
+    records users over the threshold. A background loop then summarizes
+    their older turns in small batches, one upstream call at a time and
+    only while interactive traffic is light, and replaces those turns with
+    a single summary message. The original messages stay in the chatmessage
+    table, which already holds every turn.
+    """
+
+    def __init__(self, store, threshold: int = SUMMARY_THRESHOLD_TOKENS, keep_recent: int = SUMMARY_KEEP_RECENT):
+        self.store = store
+        self.threshold = threshold
+        self.keep_recent = keep_recent
+        self._pending = {}  # username -> None, insertion ordered
+
+    def note(self, username: str, estimated_tokens: int):
+        if estimated_tokens > self.threshold:
+            self._pending[username] = None
+
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def _split(self, history: list):
+        """
+        Return the contiguous run of messages to summarize: an existing
+        summary plus user/assistant turns older than the last keep_recent.
+        """
+        start = next(
+            (i for i, m in enumerate(history) if m.role != SYSTEM or is_summary(m)),
+            len(history),
+        )
+        older = history[start:len(history) - self.keep_recent]
+        if sum(1 for m in older if m.role in (USER, ASSISTANT)) < 2:
+            return None
+        return older
+
+    async def summarize(self, client, username: str) -> bool:
+        """Summarize one user's older turns. Returns True if the history was compacted."""
+        history = self.store.get(username)
+        if history is None:
+            return False
+        older = self._split(history)
+        if older is None:
+            return False
+
+        transcript = "\n".join(
+            m.content if is_summary(m) else f"{m.role}: {m.content}"
+            for m in older
+        )
+        try:
+            data = await client.chat({
+                "model": LLAMA_MODEL,
+                "messages": [SUMMARY_INSTRUCTIONS.to_dict(), Message(USER, transcript).to_dict()],
+            }, lane=BACKGROUND)
+        except UpstreamError as e:
+            logger.warning("Summarizing history for %s failed: %s", username, e)
+            return False
+        text = reply_text(data)
+        if not text:
+            return False
+
+        usage = usage_from_response(data) or (estimate_tokens(older), estimate_tokens([Message(ASSISTANT, text)]))
+        usage_tracker.record(username, *usage)
+
+        # The history kept changing while we waited; splice by identity so
+        # turns added in the meantime are untouched
+        current = self.store.get(username)
+        if current is not history:
+            return False
+        try:
+            start = next(i for i, m in enumerate(history) if m is older[0])
+        except StopIteration:
+            return False
+        end = start + len(older)
+        if any(history[start + i] is not m for i, m in enumerate(older)):
+            return False
+        history[start:end] = [Message(SYSTEM, SUMMARY_PREFIX + text)]
+
+        metrics.inc("summarizer.compacted")
+        metrics.inc("summarizer.messages_replaced", len(older))
+        return True
+
+    async def run(self, client, interactive_inflight, interval: float = SUMMARY_INTERVAL, batch: int = SUMMARY_BATCH):
+        """
+        Background loop. interactive_inflight() returns the number of chats
+        currently in flight; summaries wait while it is at or above
+        SUMMARY_MAX_INTERACTIVE so they never take capacity from users.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            for _ in range(batch):
+                if not self._pending:
+                    break
+                if interactive_inflight() >= SUMMARY_MAX_INTERACTIVE:
+                    metrics.inc("summarizer.deferred")
+                    break
+                username = next(iter(self._pending))
+                del self._pending[username]
+                try:
+                    await self.summarize(client, username)
+                except Exception as e:
+                    logger.warning("Summarizer failed for %s: %s", username, e)
@@ -0,0 +1,120 @@
+import asyncio
+import inspect
+import logging
+import os
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Maximum queued items before submit() applies backpressure
+WORK_QUEUE_SIZE = int(os.getenv("WORK_QUEUE_SIZE", "10000"))
+# Items drained per batch
+WORK_BATCH_SIZE = int(os.getenv("WORK_BATCH_SIZE", "200"))
+# Consumer tasks; SQLite has a single writer, so one is usually right
+WORK_CONSUMERS = int(os.getenv("WORK_CONSUMERS", "1"))
+
+
+class WorkQueue:
+    """
+    Bounded in-loop queue for work that can happen after the response is sent.
+
+    Producers submit (kind, item) pairs; consumers drain up to batch_size
+    items at a time, group them by kind and call the handler registered for
+    that kind once per batch. Synchronous handlers (database writes) run in
+    a worker thread so they never block the event loop.
+    """
+
+    def __init__(self, maxsize: int = WORK_QUEUE_SIZE, batch_size: int = WORK_BATCH_SIZE,
+                 consumers: int = WORK_CONSUMERS):
+        self.batch_size = batch_size
+        self.consumers = consumers
+        self._maxsize = maxsize
+        self._queue = None
+        self._handlers = {}
+        self._tasks = []
+        self._closed = False
+
+    def register(self, kind: str, handler):
+        """handler(items: list) is called with every queued item of this kind in a batch."""
+        self._handlers[kind] = handler
+
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def capacity(self) -> int:
+        return self._maxsize
+
+    def start(self):
+        # Created here so the queue binds to the running event loop
+        self._queue = asyncio.Queue(self._maxsize)
+        self._closed = False
+        self._tasks = [asyncio.create_task(self._consume()) for _ in range(self.consumers)]
+
+    async def submit(self, kind: str, item):
+        """Queue an item, waiting for space if the queue is full."""
+        if self._closed or self._queue is None:
+            raise RuntimeError("work queue is not running")
+        if self._queue.full():
+            metrics.inc("work_queue.backpressure")
+        await self._queue.put((kind, item))
+
+    def offer(self, kind: str, item) -> bool:
+        """Queue an item if there is room; drop it otherwise. For best-effort work like analytics."""
+        if self._closed or self._queue is None:
+            return False
+        try:
+            self._queue.put_nowait((kind, item))
+            return True
+        except asyncio.QueueFull:
+            metrics.inc(f"work_queue.dropped.{kind}")
+            return False
+
+    async def _consume(self):
+        queue = self._queue
+        while True:
+            batch = [await queue.get()]
+            while len(batch) < self.batch_size and not queue.empty():
+                batch.append(queue.get_nowait())
+            try:
+                await self._dispatch(batch)
+            finally:
+                for _ in batch:
+                    queue.task_done()
+
+    async def _dispatch(self, batch):
+        grouped = {}
+        for kind, item in batch:
+            grouped.setdefault(kind, []).append(item)
+
+        for kind, items in grouped.items():
+            handler = self._handlers.get(kind)
+            if handler is None:
+                logger.warning("No handler registered for %s work items", kind)
+                continue
+            try:
+                if inspect.iscoroutinefunction(handler):
+                    await handler(items)
+                else:
+                    await asyncio.to_thread(handler, items)
+                metrics.inc(f"work_queue.processed.{kind}", len(items))
+            except Exception as e:
+                metrics.inc(f"work_queue.failed.{kind}", len(items))
+                logger.warning("Background %s batch of %d failed: %s", kind, len(items), e)
+
+    async def close(self, timeout: float = 10):
+        """Stop accepting work, drain what is queued (up to timeout seconds) and stop the consumers."""
+        if self._queue is None:
+            return
+        self._closed = True
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Work queue closed with %d items unprocessed", self._queue.qsize())
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+work_queue = WorkQueue()
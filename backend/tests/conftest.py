@@ -0,0 +1,81 @@
+import functools
+import json
+import os
+import sys
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+# Tests import the backend modules the way uvicorn does, from backend/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# musemate.create_app() refuses to start without a key; tests never reach the real API
+os.environ.setdefault("LLAMA_API_KEY", "test")
+# All app tests share one user; the limiter itself is tested on its own
+os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+
+
+class _StubLlama(BaseHTTPRequestHandler):
+    """Answers every chat completion with "echo <last message>"."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        text = "echo " + body["messages"][-1]["content"]
+        out = json.dumps({"completion_message": {"content": {"text": text}}}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(out)))
+        self.end_headers()
+        self.wfile.write(out)
+
+
+@pytest.fixture(scope="session")
+def stub_upstream():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StubLlama)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+@pytest.fixture(scope="session")
+def app(stub_upstream, tmp_path_factory):
+    """A MuseMate app talking to the stub upstream, with its database in a temp directory."""
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("db"))
+    import musemate
+    from upstream import LlamaClient
+
+    patch = pytest.MonkeyPatch()
+    patch.setattr(musemate, "LlamaClient", functools.partial(LlamaClient, base_url=stub_upstream))
+    try:
+        yield musemate.create_app()
+    finally:
+        patch.undo()
+        os.chdir(cwd)
+
+
+@pytest.fixture(scope="session")
+def client(app):
+    from fastapi.testclient import TestClient
+
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture(scope="session")
+def auth_headers(client):
+    client.post("/signup", json={"username": "tester", "password": "secret"})
+    token = client.post("/login", json={"username": "tester", "password": "secret"}).json()["token"]
+    return {"Authorization": f"Bearer {token}"}
@@ -0,0 +1,52 @@
+from history import HistoryStore
+from messages import Message, SYSTEM, USER
+
+
+def _compact(store: HistoryStore):
+    store.compact(now=float("inf"))
+
+
+def test_thawed_history_points_at_shared_message():
+    prompt = Message(SYSTEM, "You are MuseMate")
+    store = HistoryStore(shared=[prompt])
+    store.set("alice", [prompt, Message(USER, "hi")])
+    _compact(store)
+    history = store.get("alice")
+    assert history[0] is prompt
+    assert history[1].content == "hi"
+
+
+def test_unshared_message_is_kept_until_no_cold_history_needs_it():
+    old, new = Message(SYSTEM, "old prompt"), Message(SYSTEM, "new prompt")
+    store = HistoryStore(shared=[old])
+    store.set("alice", [old, Message(USER, "hi")])
+    store.set("bob", [old])
+    _compact(store)
+
+    # A catalog reload replaces the prompt
+    store.unshare(old)
+    store.share(new)
+    assert len(store._shared) == 2
+
+    assert store.get("alice")[0] is old
+    store.discard("bob")
+    assert list(store._shared.values()) == [new]
+
+    # Frozen again after the reload, the old prompt is stored as a copy
+    _compact(store)
+    assert store.get("alice")[0].content == "old prompt"
+
+
+def test_reloads_do_not_accumulate_shared_messages():
+    store = HistoryStore()
+    previous = None
+    for version in range(50):
+        prompt = Message(SYSTEM, f"prompt {version}")
+        if previous is not None:
+            store.unshare(previous)
+        store.share(prompt)
+        store.set("alice", [prompt])
+        _compact(store)
+        previous = prompt
+    assert len(store._shared) == 1
+    assert store.get("alice")[0] is previous
@@ -0,0 +1,124 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from idempotency import IdempotencyCache, fingerprint
+
+
+def test_duplicate_joins_running_request():
+    async def main():
+        cache = IdempotencyCache()
+        calls = []
+        release = asyncio.Event()
+
+        async def fn():
+            calls.append(1)
+            await release.wait()
+            return {"reply": "hi"}
+
+        first = asyncio.create_task(cache.run("k", fingerprint("hello"), fn))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(cache.run("k", fingerprint("hello"), fn))
+        await asyncio.sleep(0)
+        release.set()
+        return await first, await second, calls
+
+    first, second, calls = asyncio.run(main())
+    assert first == ({"reply": "hi"}, False)
+    assert second == ({"reply": "hi"}, True)
+    assert calls == [1]
+
+
+def test_completed_request_is_replayed():
+    async def main():
+        cache = IdempotencyCache()
+        calls = []
+
+        async def fn():
+            calls.append(1)
+            return len(calls)
+
+        return await cache.run("k", "fp", fn), await cache.run("k", "fp", fn), calls
+
+    first, second, calls = asyncio.run(main())
+    assert first == (1, False)
+    assert second == (1, True)
+    assert calls == [1]
+
+
+def test_key_reused_with_different_request():
+    async def main():
+        cache = IdempotencyCache()
+
+        async def fn():
+            return "ok"
+
+        await cache.run("k", "fp1", fn)
+        await cache.run("k", "fp2", fn)
+
+    with pytest.raises(HTTPException) as info:
+        asyncio.run(main())
+    assert info.value.status_code == 422
+
+
+def test_failed_request_can_be_retried():
+    async def main():
+        cache = IdempotencyCache()
+        attempts = []
+
+        async def fn():
+            attempts.append(1)
+            if len(attempts) == 1:
+                raise HTTPException(status_code=500, detail="Llama API failed")
+            return "ok"
+
+        with pytest.raises(HTTPException):
+            await cache.run("k", "fp", fn)
+        return await cache.run("k", "fp", fn)
+
+    assert asyncio.run(main()) == ("ok", False)
+
+
+def test_expired_and_excess_keys_are_evicted():
+    async def main():
+        cache = IdempotencyCache(ttl=0, max_keys=10)
+
+        async def fn():
+            return "ok"
+
+        await cache.run("a", "fp", fn)
+        await asyncio.sleep(0.01)
+        await cache.run("b", "fp", fn)
+        assert len(cache) == 1
+
+        cache = IdempotencyCache(ttl=60, max_keys=2)
+        for key in "abc":
+            await cache.run(key, "fp", fn)
+        assert len(cache) == 2
+
+    asyncio.run(main())
+
+
+def test_joined_duplicate_survives_original_cancellation():
+    async def main():
+        cache = IdempotencyCache()
+
+        async def fn():
+            await asyncio.sleep(10)
+
+        first = asyncio.create_task(cache.run("k", "fp", fn))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(cache.run("k", "fp", fn))
+        await asyncio.sleep(0)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        with pytest.raises(HTTPException) as info:
+            await second
+        assert not second.cancelled()
+        assert info.value.status_code == 503
+        # The key is free again for a retry
+        assert len(cache) == 0
+
+    asyncio.run(main())
@@ -0,0 +1,39 @@
+import time
+
+import pytest
+
+from loopmonitor import loop_monitor
+
+
+@pytest.fixture(scope="module")
+def blocking_route(app):
+    # A handler that makes the classic mistake: a blocking call inside async def
+    @app.get("/test/blocking")
+    async def blocking():
+        time.sleep(loop_monitor.threshold * 3)
+        return {}
+
+
+def test_chat_does_not_block_event_loop(client, auth_headers):
+    with loop_monitor.capture() as blocks:
+        for i in range(3):
+            response = client.post("/chat", json={"content": f"hello {i}"}, headers=auth_headers)
+            assert response.status_code == 200
+        client.post("/chat/batch", json={"prompts": ["caption one", "caption two"]}, headers=auth_headers)
+        client.get("/history", headers=auth_headers)
+    assert not blocks, blocks[0]["stack"]
+
+
+def test_blocking_handler_is_detected(client, blocking_route):
+    with loop_monitor.capture() as blocks:
+        assert client.get("/test/blocking").status_code == 200
+    assert blocks
+    assert "time.sleep" in blocks[0]["stack"]
+    assert blocks[0]["blocked_ms"] >= loop_monitor.threshold * 1000
+
+
+def test_metrics_are_admin_only(client, auth_headers, monkeypatch):
+    assert client.get("/metrics").status_code == 401
+    assert client.get("/metrics", headers=auth_headers).status_code == 403
+    monkeypatch.setenv("ADMIN_USERS", "tester")
+    assert "event_loop" in client.get("/metrics", headers=auth_headers).json()
@@ -0,0 +1,49 @@
+from promptcache import SemanticCache
+
+PROMPT = "How much do 50 custom printed t-shirts cost?"
+
+
+def _cache(**kwargs) -> SemanticCache:
+    return SemanticCache(enabled=True, threshold=0.8, **kwargs)
+
+
+def test_near_duplicate_prompt_hits():
+    cache = _cache()
+    cache.store(cache.embed(PROMPT), 1, "About $400")
+    entry = cache.lookup(cache.embed("how much do 50 custom printed shirts cost"), 1)
+    assert entry is not None and entry.reply == "About $400"
+
+
+def test_different_numbers_or_catalog_version_miss():
+    cache = _cache()
+    cache.store(cache.embed(PROMPT), 1, "About $400")
+    assert cache.lookup(cache.embed(PROMPT.replace("50", "500")), 1) is None
+    assert cache.lookup(cache.embed(PROMPT), 2) is None
+
+
+def test_prompt_is_projected_once_per_lookup_and_store():
+    cache = _cache()
+    calls = []
+    projections = cache._projections
+    cache._projections = lambda vector: calls.append(vector) or projections(vector)
+
+    embedding = cache.embed(PROMPT)
+    assert cache.lookup(embedding, 1) is None
+    cache.store(embedding, 1, "About $400")
+    assert len(calls) == 1
+
+
+def test_prompt_without_words_is_not_cached():
+    cache = _cache()
+    assert cache.embed("?? !!") is None
+    assert cache.lookup(None, 1) is None
+    cache.store(None, 1, "reply")
+    assert cache.stats()["entries"] == 0
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = _cache(max_entries=2)
+    for prompt in ("blue hoodie sizes", "red mug price", "canvas tote bag colours"):
+        cache.store(cache.embed(prompt), 1, prompt)
+    assert cache.stats()["entries"] == 2
+    assert cache.lookup(cache.embed("blue hoodie sizes"), 1) is None
@@ -0,0 +1,80 @@
+import pytest
+
+from ratelimit import MemoryBuckets, SQLiteBuckets, Policy
+
+
+def test_burst_then_reject():
+    buckets = MemoryBuckets()
+    policy = Policy(per_minute=60, burst=3)
+    assert [buckets.take("u", policy, now=0.0)[0] for _ in range(3)] == [True, True, True]
+    allowed, retry_after = buckets.take("u", policy, now=0.0)
+    assert not allowed
+    assert retry_after == 1.0
+
+
+def test_refill_from_elapsed_time():
+    buckets = MemoryBuckets()
+    policy = Policy(per_minute=60, burst=2)
+    buckets.take("u", policy, now=0.0)
+    buckets.take("u", policy, now=0.0)
+    assert not buckets.take("u", policy, now=0.5)[0]
+    # Half a token was left after the rejected take; half a second more completes it
+    assert buckets.take("u", policy, now=1.0)[0]
+    assert not buckets.take("u", policy, now=1.0)[0]
+
+
+def test_refill_is_capped_at_burst():
+    buckets = MemoryBuckets()
+    policy = Policy(per_minute=60, burst=2)
+    buckets.take("u", policy, now=0.0)
+    results = [buckets.take("u", policy, now=1000.0)[0] for _ in range(3)]
+    assert results == [True, True, False]
+
+
+def test_keys_are_independent():
+    buckets = MemoryBuckets()
+    policy = Policy(per_minute=60, burst=1)
+    assert buckets.take("a", policy, now=0.0)[0]
+    assert not buckets.take("a", policy, now=0.0)[0]
+    assert buckets.take("b", policy, now=0.0)[0]
+
+
+def test_idle_buckets_are_evicted():
+    buckets = MemoryBuckets()
+    policy = Policy(per_minute=60, burst=2)  # full again after 2s idle
+    buckets.take("idle", policy, now=0.0)
+    buckets.take("busy", policy, now=1.0)
+    assert len(buckets) == 2
+    buckets.take("busy", policy, now=2.5)
+    assert len(buckets) == 1
+
+
+def test_least_recently_used_evicted_over_capacity():
+    buckets = MemoryBuckets(max_buckets=2)
+    policy = Policy(per_minute=60, burst=5)
+    buckets.take("a", policy, now=0.0)
+    buckets.take("b", policy, now=0.0)
+    buckets.take("a", policy, now=0.0)  # "b" is now least recently used
+    buckets.take("c", policy, now=0.0)
+    assert len(buckets) == 2
+    # "a" kept its spent tokens, "b" starts over with a full bucket
+    assert [buckets.take("a", policy, now=0.0)[0] for _ in range(4)] == [True, True, True, False]
+    assert [buckets.take("b", policy, now=0.0)[0] for _ in range(5)] == [True] * 5
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request, tmp_path):
+    return MemoryBuckets() if request.param == "memory" else SQLiteBuckets(str(tmp_path / "buckets.db"))
+
+
+def test_rejected_request_takes_no_token_from_other_buckets(backend):
+    ip, user = Policy(per_minute=60, burst=2), Policy(per_minute=60, burst=1)
+    checks = [("ip", ip), ("user:alice", user)]
+    assert backend.take_all(checks, now=0.0) == (None, 0.0)
+    rejected, retry_after = backend.take_all(checks, now=0.0)
+    assert rejected == "user:alice" and retry_after == 1.0
+
+    # alice's rejected requests did not use up the IP budget another user shares
+    others = [("ip", ip), ("user:bob", user)]
+    assert backend.take_all(others, now=0.0)[0] is None
+    assert backend.take_all([("ip", ip), ("user:carol", user)], now=0.0)[0] == "ip"
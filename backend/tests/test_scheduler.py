@@ -0,0 +1,108 @@
+import asyncio
+
+import pytest
+
+from scheduler import Scheduler, lane_for, INTERACTIVE, BULK, BACKGROUND
+
+WEIGHTS = {INTERACTIVE: 8, BULK: 2, BACKGROUND: 1}
+
+
+async def _fill(scheduler: Scheduler, lane: str, count: int) -> list:
+    """Start count calls in lane that hold their slot until released; return their release events."""
+    events = []
+    for _ in range(count):
+        release = asyncio.Event()
+        events.append(release)
+
+        async def hold(release=release):
+            async with scheduler.slot(lane):
+                await release.wait()
+
+        asyncio.create_task(hold())
+    await asyncio.sleep(0)
+    return events
+
+
+def test_floor_keeps_slots_for_interactive():
+    async def main():
+        scheduler = Scheduler(6, WEIGHTS, {INTERACTIVE: 2, BULK: 0, BACKGROUND: 0})
+        bulk = await _fill(scheduler, BULK, 10)
+        lanes = scheduler.stats()["lanes"]
+        assert lanes[BULK]["in_use"] == 4
+        assert lanes[BULK]["waiting"] == 6
+
+        # Interactive gets its floor without waiting for any bulk call
+        await asyncio.wait_for(scheduler.acquire(INTERACTIVE), timeout=0.1)
+        await asyncio.wait_for(scheduler.acquire(INTERACTIVE), timeout=0.1)
+        assert scheduler.stats()["free"] == 0
+        for release in bulk:
+            release.set()
+
+    asyncio.run(main())
+
+
+def test_lane_may_use_whole_pool_when_others_reserve_nothing():
+    async def main():
+        scheduler = Scheduler(4, WEIGHTS, {INTERACTIVE: 0, BULK: 0, BACKGROUND: 0})
+        await _fill(scheduler, BULK, 4)
+        assert scheduler.stats()["lanes"][BULK]["in_use"] == 4
+
+    asyncio.run(main())
+
+
+def test_waiting_lanes_share_slots_by_weight():
+    async def main():
+        scheduler = Scheduler(1, WEIGHTS, {INTERACTIVE: 0, BULK: 0, BACKGROUND: 0})
+        order = []
+
+        async def call(lane):
+            async with scheduler.slot(lane):
+                order.append(lane)
+                await asyncio.sleep(0)
+
+        blocker = await _fill(scheduler, BULK, 1)
+        tasks = [asyncio.create_task(call(lane)) for lane in [BULK] * 20 + [BACKGROUND] * 20 + [INTERACTIVE] * 80]
+        await asyncio.sleep(0)
+        blocker[0].set()
+        await asyncio.gather(*tasks)
+        return order
+
+    order = asyncio.run(main())
+    # While all three lanes are backlogged, grants follow the 8:2:1 weights
+    window = order[:55]
+    assert window.count(INTERACTIVE) == pytest.approx(40, abs=2)
+    assert window.count(BULK) == pytest.approx(10, abs=2)
+    assert window.count(BACKGROUND) == pytest.approx(5, abs=2)
+
+
+def test_cancelled_waiter_gives_up_its_place():
+    async def main():
+        scheduler = Scheduler(1, WEIGHTS, {INTERACTIVE: 0, BULK: 0, BACKGROUND: 0})
+        blocker = await _fill(scheduler, BULK, 1)
+        waiter = asyncio.create_task(scheduler.acquire(BULK))
+        await asyncio.sleep(0)
+        assert scheduler.stats()["lanes"][BULK]["waiting"] == 1
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert scheduler.stats()["lanes"][BULK]["waiting"] == 0
+
+        blocker[0].set()
+        await asyncio.sleep(0)
+        assert scheduler.stats()["free"] == 1
+
+    asyncio.run(main())
+
+
+def test_floors_are_trimmed_to_capacity():
+    scheduler = Scheduler(3, WEIGHTS, {INTERACTIVE: 4, BULK: 1, BACKGROUND: 0})
+    lanes = scheduler.stats()["lanes"]
+    assert lanes[INTERACTIVE]["floor"] == 3
+    assert lanes[BULK]["floor"] == 0
+
+
+def test_clients_can_only_lower_their_lane():
+    assert lane_for("someone") == INTERACTIVE
+    assert lane_for("someone", requested=BULK) == BULK
+    assert lane_for("someone", requested=INTERACTIVE, default=BULK) == BULK
+    assert lane_for("someone", requested="urgent") == INTERACTIVE
@@ -0,0 +1,28 @@
+import pytest
+
+from tracing import _incoming_trace_id
+
+TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+
+
+def _scope(name: str, value: str) -> dict:
+    return {"headers": [(name.encode(), value.encode("latin-1"))]}
+
+
+def test_traceparent_trace_id_is_used():
+    assert _incoming_trace_id(_scope("traceparent", f"00-{TRACE_ID}-00f067aa0ba902b7-01")) == TRACE_ID
+
+
+@pytest.mark.parametrize("trace_id", [
+    "0" * 32,
+    TRACE_ID.upper(),
+    "4bf92f3577b34da6a3ce929d0e0e473g",
+    "4bf92f3577b34da6\r\nX-Injected: 1",
+])
+def test_invalid_traceparent_trace_id_is_ignored(trace_id):
+    assert _incoming_trace_id(_scope("traceparent", f"00-{trace_id}-00f067aa0ba902b7-01")) is None
+
+
+def test_request_id_header_is_validated():
+    assert _incoming_trace_id(_scope("x-request-id", "abc-123")) == "abc-123"
+    assert _incoming_trace_id(_scope("x-request-id", "bad id")) is None
@@ -0,0 +1,39 @@
+import pytest
+
+import musemate
+from traffic import traffic_recorder
+
+
+@pytest.fixture
+def recorded(monkeypatch):
+    events = []
+    offer = musemate.work_queue.offer
+
+    def capture(kind, item):
+        if kind == "traffic":
+            events.append(item)
+            return True
+        return offer(kind, item)
+
+    monkeypatch.setattr(traffic_recorder, "enabled", True)
+    monkeypatch.setattr(musemate.work_queue, "offer", capture)
+    return events
+
+
+def test_unexpected_error_is_recorded_as_500(client, auth_headers, recorded, monkeypatch):
+    async def broken(*args, **kwargs):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(musemate, "chat_turn", broken)
+    with pytest.raises(RuntimeError):
+        client.post("/chat", json={"content": "hello"}, headers=auth_headers)
+    assert [event[-1] for event in recorded] == [500]
+
+
+def test_idempotent_replay_is_not_recorded(client, auth_headers, recorded):
+    headers = {**auth_headers, "Idempotency-Key": "traffic-replay"}
+    first = client.post("/chat", json={"content": "hello"}, headers=headers)
+    second = client.post("/chat", json={"content": "hello"}, headers=headers)
+    assert second.headers.get("Idempotent-Replayed") == "true"
+    assert second.json() == first.json()
+    assert [event[-1] for event in recorded] == [200]
@@ -0,0 +1,140 @@
+import asyncio
+import threading
+
+import pytest
+
+from upstream import LlamaClient, UpstreamError, UPSTREAM_CIRCUIT_FAILURES, UPSTREAM_CIRCUIT_RESET
+
+
+def _raising(error: UpstreamError):
+    def post(payload, headers=None):
+        raise error
+    return post
+
+
+def _failing_client(error: UpstreamError) -> LlamaClient:
+    client = LlamaClient("test", base_url="http://127.0.0.1:9", pool_size=2)
+    client._post = _raising(error)
+    return client
+
+
+def _fail(client: LlamaClient, times: int):
+    async def main():
+        for _ in range(times):
+            with pytest.raises(UpstreamError):
+                await client.chat({"messages": []})
+
+    asyncio.run(main())
+
+
+@pytest.mark.parametrize("status", [None, 500, 503, 429])
+def test_unavailable_api_opens_circuit(status):
+    client = _failing_client(UpstreamError("down", status=status))
+    try:
+        _fail(client, UPSTREAM_CIRCUIT_FAILURES)
+        assert client.circuit_state() == "open"
+    finally:
+        client.close()
+
+
+@pytest.mark.parametrize("status", [400, 413, 422])
+def test_request_errors_do_not_open_circuit(status):
+    client = _failing_client(UpstreamError("bad request", status=status))
+    try:
+        _fail(client, UPSTREAM_CIRCUIT_FAILURES * 2)
+        assert client.circuit_state() == "closed"
+    finally:
+        client.close()
+
+
+def test_api_answer_resets_failure_count():
+    client = _failing_client(UpstreamError("down", status=502))
+    try:
+        _fail(client, UPSTREAM_CIRCUIT_FAILURES - 1)
+        client._post = _raising(UpstreamError("bad request", status=400))
+        _fail(client, 1)
+        client._post = _raising(UpstreamError("down", status=502))
+        _fail(client, UPSTREAM_CIRCUIT_FAILURES - 1)
+        assert client.circuit_state() == "closed"
+    finally:
+        client.close()
+
+
+def test_cancelled_call_holds_its_slot_until_the_request_returns():
+    client = LlamaClient("test", base_url="http://127.0.0.1:9", pool_size=2)
+    returned = threading.Event()
+    release = threading.Event()
+
+    def post(payload, headers=None):
+        release.wait(5)
+        returned.set()
+        return {}
+
+    client._post = post
+
+    async def main():
+        call = asyncio.create_task(client.chat({"messages": []}))
+        await asyncio.sleep(0.05)
+        call.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await call
+        # The pool thread is still busy with the abandoned request
+        assert client.scheduler.stats()["free"] == 1
+
+        release.set()
+        await asyncio.to_thread(returned.wait, 5)
+        for _ in range(10):
+            await asyncio.sleep(0.01)
+            if client.scheduler.stats()["free"] == 2:
+                break
+        assert client.scheduler.stats()["free"] == 2
+
+    try:
+        asyncio.run(main())
+    finally:
+        client.close()
+
+
+def test_half_open_circuit_lets_one_trial_through():
+    client = _failing_client(UpstreamError("down", status=503))
+    try:
+        _fail(client, UPSTREAM_CIRCUIT_FAILURES)
+        # Pretend the reset interval has passed
+        client._last_failure -= UPSTREAM_CIRCUIT_RESET
+        assert client.circuit_state() == "half_open"
+
+        release = threading.Event()
+        sent = []
+
+        def post(payload, headers=None):
+            sent.append(payload)
+            release.wait(5)
+            return {}
+
+        client._post = post
+
+        async def main():
+            trial = asyncio.create_task(client.chat({"messages": []}))
+            await asyncio.sleep(0.05)
+            for _ in range(3):
+                with pytest.raises(UpstreamError, match="circuit is open"):
+                    await client.chat({"messages": []})
+            release.set()
+            await trial
+
+        asyncio.run(main())
+        assert len(sent) == 1
+        assert client.circuit_state() == "closed"
+    finally:
+        client.close()
+
+
+def test_failed_trial_reopens_circuit():
+    client = _failing_client(UpstreamError("down", status=503))
+    try:
+        _fail(client, UPSTREAM_CIRCUIT_FAILURES)
+        client._last_failure -= UPSTREAM_CIRCUIT_RESET
+        _fail(client, 1)
+        assert client.circuit_state() == "open"
+    finally:
+        client.close()
@@ -0,0 +1,28 @@
+from usage import UsageTracker
+
+
+def test_budget_is_shared_by_workers(client):
+    # Two trackers on one database stand in for two uvicorn workers
+    first, second = UsageTracker(daily_budget=100), UsageTracker(daily_budget=100)
+    first.load()
+    second.load()
+
+    first.record("shared-budget", 50, 20)
+    second.record("shared-budget", 10, 0)
+    first.flush()
+    second.flush()
+    assert second.used_today("shared-budget") == 80
+    assert not second.within_budget("shared-budget", 30)
+
+    first.flush()
+    assert first.used_today("shared-budget") == 80
+
+
+def test_unflushed_usage_counts_after_refresh(client):
+    tracker = UsageTracker(daily_budget=100)
+    tracker.load()
+    tracker.record("pending-usage", 30, 0)
+    tracker.flush()
+    tracker.record("pending-usage", 5, 0)
+    tracker.load()
+    assert tracker.used_today("pending-usage") == 35
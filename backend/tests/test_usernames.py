@@ -0,0 +1,35 @@
+from auth import create_user
+from metrics import metrics
+from usernames import UsernameCache, usernames
+
+
+def test_taken_names_are_remembered_lru():
+    cache = UsernameCache(cache_size=2)
+    assert not cache.known_taken("a")
+    cache.taken("a")
+    cache.taken("b")
+    assert cache.known_taken("a")  # "b" is now least recently used
+    cache.taken("c")
+    assert cache.known_taken("a")
+    assert cache.known_taken("c")
+    assert not cache.known_taken("b")
+
+
+def test_create_user_refuses_duplicates(client, monkeypatch):
+    from sqlmodel import Session
+    from db import get_engine
+
+    with Session(get_engine()) as session:
+        assert create_user("unique-name", "pw", session)
+
+        # Another worker has not seen the name: its insert hits the unique index
+        monkeypatch.setattr(usernames, "known_taken", lambda username: False)
+        conflicts = metrics.counter("signup.conflicts")
+        assert not create_user("unique-name", "pw", session)
+        assert metrics.counter("signup.conflicts") == conflicts + 1
+        monkeypatch.undo()
+
+        # This worker has: refused without hashing or an insert
+        rejected = metrics.counter("signup.cache_rejected")
+        assert not create_user("unique-name", "pw", session)
+        assert metrics.counter("signup.cache_rejected") == rejected + 1
@@ -0,0 +1,190 @@
+import atexit
+import contextlib
+import contextvars
+import logging
+import logging.handlers
+import os
+import queue
+import re
+import secrets
+import sys
+import time
+
+from metrics import metrics
+from serialization import dumps
+
+# Header carrying the request's trace ID in and out (a W3C traceparent header is also accepted)
+TRACE_HEADER = os.getenv("TRACE_HEADER", "X-Request-ID")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+# "json" for one JSON object per line, "text" for human-readable lines
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+# Health and metrics polls only get a request log line when they fail
+QUIET_PATHS = {"/", "/ready", "/metrics"}
+
+trace_id = contextvars.ContextVar("trace_id", default=None)
+_spans = contextvars.ContextVar("spans", default=None)
+
+_VALID_ID = re.compile(r"^[A-Za-z0-9._:-]{1,128}$")
+# W3C trace-id: 32 lowercase hex digits, all zeros is invalid
+_TRACEPARENT_ID = re.compile(r"^(?!0{32}$)[0-9a-f]{32}$")
+
+
+def current_trace_id():
+    return trace_id.get()
+
+
+@contextlib.contextmanager
+def span(name: str):
+    """Time a stage of the current request; shows up in its request log line."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        ms = (time.perf_counter() - started) * 1000
+        spans = _spans.get()
+        if spans is not None:
+            spans[name] = round(spans.get(name, 0) + ms, 2)
+        metrics.observe(f"span.{name}_ms", ms)
+
+
+def _incoming_trace_id(scope):
+    header = TRACE_HEADER.lower().encode()
+    for name, value in scope.get("headers", ()):
+        if name == header:
+            value = value.decode("latin-1").strip()
+            if _VALID_ID.match(value):
+                return value
+        elif name == b"traceparent":
+            # version-traceid-parentid-flags
+            parts = value.decode("latin-1").split("-")
+            if len(parts) == 4 and _TRACEPARENT_ID.match(parts[1]):
+                return parts[1]
+    return None
+
+
+class TraceMiddleware:
+    """
+    ASGI middleware giving every request a trace ID and a log line.
+
+    The ID comes from the TRACE_HEADER (or traceparent) request header, or
+    is generated, and is echoed back in the response. While the request
+    runs it is available to log records and to the upstream client, and
+    span() timings are collected for the final "request" log line.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.logger = logging.getLogger("musemate.requests")
+        self.header = TRACE_HEADER.lower().encode()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        request_id = _incoming_trace_id(scope) or secrets.token_hex(8)
+        id_token = trace_id.set(request_id)
+        spans = {}
+        spans_token = _spans.set(spans)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_traced(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message = {**message, "headers": [*message.get("headers", ()), (self.header, request_id.encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_traced)
+        finally:
+            if status >= 400 or scope["path"] not in QUIET_PATHS:
+                self.logger.info("request", extra={"fields": {
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "status": status,
+                    "ms": round((time.perf_counter() - started) * 1000, 2),
+                    "spans": spans,
+                }})
+            _spans.reset(spans_token)
+            trace_id.reset(id_token)
+
+
+class _TraceFilter(logging.Filter):
+    # Runs in the thread that logs, where the request's context is visible
+    def filter(self, record):
+        record.trace_id = trace_id.get()
+        return True
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if getattr(record, "trace_id", None):
+            entry["trace_id"] = record.trace_id
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return dumps(entry).decode()
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s [%(trace_id)s] %(message)s")
+
+    def format(self, record):
+        record.trace_id = getattr(record, "trace_id", None) or "-"
+        line = super().format(record)
+        fields = getattr(record, "fields", None)
+        return f"{line} {dumps(fields).decode()}" if fields else line
+
+
+_listener = None
+_handler = None
+
+
+def configure_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT):
+    """
+    Route the root logger through a queue: callers (including the event
+    loop) only enqueue records, and a listener thread formats and writes
+    them to stderr. Safe to call more than once.
+    """
+    global _listener, _handler
+    if _listener is not None:
+        return
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(JSONFormatter() if fmt == "json" else TextFormatter())
+    records = queue.SimpleQueue()
+    _handler = logging.handlers.QueueHandler(records)
+    _handler.addFilter(_TraceFilter())
+
+    root = logging.getLogger()
+    root.setLevel(level.upper())
+    root.addHandler(_handler)
+    # SQLAlchemy's echo=True adds its own stdout handler to a logger that has
+    # none; give it a no-op one so SQL lines only go through the queue
+    engine_logger = logging.getLogger("sqlalchemy.engine.Engine")
+    for existing in list(engine_logger.handlers):
+        if type(existing) is logging.StreamHandler:
+            engine_logger.removeHandler(existing)
+    if not engine_logger.handlers:
+        engine_logger.addHandler(logging.NullHandler())
+    _listener = logging.handlers.QueueListener(records, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Write out queued log records and stop the listener thread."""
+    global _listener, _handler
+    if _listener is not None:
+        logging.getLogger().removeHandler(_handler)
+        _listener.stop()
+        _listener = _handler = None
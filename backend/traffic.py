@@ -0,0 +1,65 @@
+import hashlib
+import os
+import secrets
+import time
+
+from serialization import dumps
+
+# Append anonymized /chat timings and sizes to this file (unset: recording
+# off). With several workers, include {pid} so each writes its own file.
+TRAFFIC_RECORD_PATH = os.getenv("TRAFFIC_RECORD_PATH")
+
+# Column order of every record line after the header
+FIELDS = ["t", "user", "prompt_chars", "history_messages", "reply_chars", "upstream_ms", "total_ms", "status"]
+
+
+class TrafficRecorder:
+    """
+    Records the shape of /chat traffic for bench/replay.py.
+
+    Each chat becomes one compact JSON array (see FIELDS): arrival time in
+    seconds since recording started, an anonymous user id, message and
+    reply sizes, history length, timings and status. No message text is
+    kept, and user ids are hashed with a salt that only lives in this
+    process, so a recording cannot be joined back to usernames.
+    Lines are written in batches by the work queue. Every process starts
+    its part of the file with a header line whose "started" is the wall
+    clock time that process's offsets count from, so files or sections
+    from several workers can be merged on one timeline.
+    """
+
+    def __init__(self, path: str = TRAFFIC_RECORD_PATH):
+        self.path = path.format(pid=os.getpid()) if path else None
+        self.enabled = bool(path)
+        self._salt = secrets.token_bytes(16)
+        # Offsets use the monotonic clock; the header records where they start in wall time
+        self._started = time.monotonic()
+        self._started_wall = time.time()
+        self._header_written = False
+
+    def anonymize(self, username: str) -> str:
+        return hashlib.blake2b(username.encode(), key=self._salt, digest_size=6).hexdigest()
+
+    def event(self, username: str, prompt_chars: int, history_messages: int, reply_chars: int,
+              upstream_ms: float, total_ms: float, status: int) -> list:
+        return [
+            round(time.monotonic() - self._started, 3),
+            self.anonymize(username),
+            prompt_chars,
+            history_messages,
+            reply_chars,
+            round(upstream_ms, 1),
+            round(total_ms, 1),
+            status,
+        ]
+
+    def write(self, events: list):
+        """Append a batch of events. This is the work queue handler for "traffic" items."""
+        with open(self.path, "ab") as f:
+            if not self._header_written:
+                f.write(dumps({"version": 1, "fields": FIELDS, "started": self._started_wall}) + b"\n")
+                self._header_written = True
+            f.write(b"".join(dumps(event) + b"\n" for event in events))
+
+
+traffic_recorder = TrafficRecorder()
@@ -0,0 +1,49 @@
+"""
+requests/urllib3 pieces of the upstream client. Imported by LlamaClient
+when it is created, so requests stays off the app's import path.
+"""
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.connection import is_connection_dropped  # noqa: F401  (used by LlamaClient)
+
+from metrics import metrics
+
+
+def _timed_connect(connect):
+    def wrapper(self):
+        started = time.perf_counter()
+        connect(self)
+        metrics.observe("upstream.handshake_ms", (time.perf_counter() - started) * 1000)
+        metrics.inc("upstream.connections_opened")
+    return wrapper
+
+
+class _TimedHTTPConnection(HTTPConnection):
+    connect = _timed_connect(HTTPConnection.connect)
+
+
+class _TimedHTTPSConnection(HTTPSConnection):
+    connect = _timed_connect(HTTPSConnection.connect)
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class InstrumentedAdapter(HTTPAdapter):
+    """HTTPAdapter whose connections report handshake time and count to metrics."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _TimedHTTPConnectionPool,
+            "https": _TimedHTTPSConnectionPool,
+        }
@@ -0,0 +1,271 @@
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import metrics
+from scheduler import Scheduler, INTERACTIVE
+from serialization import dumps, loads
+from tracing import current_trace_id, TRACE_HEADER
+
+logger = logging.getLogger(__name__)
+
+# Base URL of the Llama API (point at a mock server for load tests)
+LLAMA_API_URL = os.getenv("LLAMA_API_URL", "https://api.llama.com")
+LLAMA_MODEL = os.getenv("LLAMA_MODEL", "Llama-4-Maverick-17B-128E-Instruct-FP8")
+# Pooled keep-alive connections to the API, and worker threads issuing requests
+UPSTREAM_POOL_SIZE = int(os.getenv("UPSTREAM_POOL_SIZE", "16"))
+# Connections opened at startup so the first chats skip DNS/TCP/TLS setup
+UPSTREAM_PREWARM = int(os.getenv("UPSTREAM_PREWARM", "4"))
+# Ping idle pooled connections this often (seconds) while traffic is light
+UPSTREAM_KEEPALIVE_INTERVAL = float(os.getenv("UPSTREAM_KEEPALIVE_INTERVAL", "30"))
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "5"))
+UPSTREAM_READ_TIMEOUT = float(os.getenv("UPSTREAM_READ_TIMEOUT", "120"))
+# Consecutive failed calls that open the circuit, and seconds before a trial call is let through
+UPSTREAM_CIRCUIT_FAILURES = int(os.getenv("UPSTREAM_CIRCUIT_FAILURES", "5"))
+UPSTREAM_CIRCUIT_RESET = float(os.getenv("UPSTREAM_CIRCUIT_RESET", "30"))
+
+
+class UpstreamError(Exception):
+    """
+    The Llama API call failed. status is the HTTP status (None when no
+    response arrived) and response_text the error body if there was one.
+    """
+
+    def __init__(self, message: str, response_text: str = "", status: int = None):
+        super().__init__(message)
+        self.response_text = response_text
+        self.status = status
+
+    @property
+    def unavailable(self) -> bool:
+        """True if the API itself is failing or overloaded rather than rejecting this request."""
+        return self.status is None or self.status >= 500 or self.status == 429
+
+
+def reply_text(data: dict):
+    """The reply text of a chat completions response body, or None if it has none."""
+    return data.get("completion_message", {}).get("content", {}).get("text")
+
+
+class LlamaClient:
+    """
+    Pooled client for the Llama chat completions API.
+
+    Requests go through one requests.Session with a keep-alive pool of
+    pool_size connections, on a dedicated thread pool of the same size so
+    the blocking HTTP call never runs on the event loop.
+
+    A simple circuit breaker fails calls fast once UPSTREAM_CIRCUIT_FAILURES
+    calls in a row have found the API unavailable (connection errors,
+    timeouts, 5xx and 429). After UPSTREAM_CIRCUIT_RESET seconds it lets a
+    single trial call through while the rest keep failing fast; an answer
+    to the trial closes the circuit, a failure re-opens it. A 4xx caused by
+    one request's payload says nothing about the API and does not count.
+
+    Calls wait for one of the pool_size slots in their scheduler lane
+    (see scheduler.py), so bulk and background work cannot crowd out
+    interactive chats. A slot is held until the HTTP call returns, even
+    when the caller is cancelled first, because the pool thread stays busy
+    until then.
+    """
+
+    def __init__(self, api_key: str, base_url: str = LLAMA_API_URL, pool_size: int = UPSTREAM_POOL_SIZE):
+        self.base_url = base_url.rstrip("/")
+        self.pool_size = pool_size
+        self._headers = {
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json",
+        }
+        from transport import requests, InstrumentedAdapter
+
+        self._adapter = InstrumentedAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self._session = requests.Session()
+        self._session.mount("https://", self._adapter)
+        self._session.mount("http://", self._adapter)
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="llama")
+        self.scheduler = Scheduler(pool_size)
+        self._last_request = 0.0
+        self._failures = 0
+        self._last_failure = 0.0
+        self._trial_in_flight = False
+
+    def _post(self, payload, headers: dict = None) -> dict:
+        from transport import requests
+
+        url = f"{self.base_url}/v1/chat/completions"
+        try:
+            response = self._session.post(
+                url,
+                headers={**self._headers, **headers} if headers else self._headers,
+                data=payload if isinstance(payload, bytes) else dumps(payload),
+                timeout=(UPSTREAM_CONNECT_TIMEOUT, UPSTREAM_READ_TIMEOUT),
+            )
+        except requests.exceptions.RequestException as e:
+            raise UpstreamError(str(e)) from e
+        if response.status_code >= 400:
+            raise UpstreamError(f"{response.status_code} error from Llama API", response.text, response.status_code)
+        try:
+            return loads(response.content)
+        except ValueError as e:
+            raise UpstreamError("Llama API returned invalid JSON", response.text, response.status_code) from e
+
+    async def chat(self, payload, headers: dict = None, lane: str = INTERACTIVE) -> dict:
+        """
+        POST a chat completions payload (a dict, or an already encoded JSON
+        body) in the given scheduler lane and return the decoded response body.
+        """
+        state = self.circuit_state()
+        if state == "open" or (state == "half_open" and self._trial_in_flight):
+            metrics.inc("upstream.circuit_rejected")
+            raise UpstreamError("Llama API circuit is open")
+        # In half_open only this call goes through; its result closes or re-opens the circuit
+        trial = state == "half_open"
+        self._trial_in_flight = trial
+        try:
+            return await self._call(payload, headers, lane)
+        finally:
+            if trial:
+                self._trial_in_flight = False
+
+    async def _call(self, payload, headers: dict, lane: str) -> dict:
+        request_id = current_trace_id()
+        if request_id is not None:
+            # Lets the provider's logs be matched to ours
+            headers = {**headers, TRACE_HEADER: request_id} if headers else {TRACE_HEADER: request_id}
+        loop = asyncio.get_running_loop()
+        await self.scheduler.acquire(lane)
+        try:
+            self._last_request = time.monotonic()
+            metrics.inc("upstream.requests")
+            call = loop.run_in_executor(self._executor, self._post, payload, headers)
+        except BaseException:
+            self.scheduler.release(lane)
+            raise
+        # A cancelled caller cannot stop the HTTP call already running on a
+        # pool thread, so the slot is only released once the call returns;
+        # otherwise abandoned calls would fill the pool outside the scheduler
+        call.add_done_callback(lambda done: self._finished(done, lane))
+        try:
+            data = await asyncio.shield(call)
+        except UpstreamError as e:
+            if not e.unavailable:
+                # The API answered; only this request was at fault
+                self._failures = 0
+                raise
+            self._failures += 1
+            self._last_failure = time.monotonic()
+            if self._failures == UPSTREAM_CIRCUIT_FAILURES:
+                logger.warning("Llama API circuit opened after %d failed calls", self._failures)
+                metrics.inc("upstream.circuit_opened")
+            raise
+        self._failures = 0
+        return data
+
+    def _finished(self, call: asyncio.Future, lane: str):
+        if not call.cancelled():
+            # Retrieve the error of a call nobody awaits any more so asyncio does not log it
+            call.exception()
+        self.scheduler.release(lane)
+
+    def circuit_state(self) -> str:
+        """"closed" (healthy), "open" (failing fast) or "half_open" (one trial call is let through)."""
+        if self._failures < UPSTREAM_CIRCUIT_FAILURES:
+            return "closed"
+        if time.monotonic() - self._last_failure < UPSTREAM_CIRCUIT_RESET:
+            return "open"
+        return "half_open"
+
+    def _pool(self):
+        # Resolve the pool exactly as Session.post would (same CA bundle
+        # settings), otherwise warm-up fills a pool requests never uses
+        from transport import requests
+
+        request = requests.Request("POST", f"{self.base_url}/v1/chat/completions").prepare()
+        settings = self._session.merge_environment_settings(request.url, {}, None, None, None)
+        if hasattr(self._adapter, "get_connection_with_tls_context"):
+            return self._adapter.get_connection_with_tls_context(request, verify=settings["verify"])
+        return self._adapter.get_connection(request.url)
+
+    def _warm(self, count: int, ping: bool) -> int:
+        """
+        Check out up to count connections at once, (re)connect any that are
+        closed, optionally ping open ones, and return them to the pool.
+        Returns how many connections were handled.
+        """
+        from transport import is_connection_dropped
+
+        pool = self._pool()
+        conns = []
+        try:
+            for _ in range(min(count, self.pool_size)):
+                conns.append(pool._get_conn())
+
+            def touch(conn):
+                if conn.sock is None or is_connection_dropped(conn):
+                    conn.close()
+                    conn.connect()
+                    metrics.inc("upstream.connections_warmed")
+                elif ping:
+                    # Cheap request that keeps the connection from idling out
+                    conn.request("HEAD", "/")
+                    conn.getresponse().read()
+
+            with ThreadPoolExecutor(max_workers=max(len(conns), 1)) as executor:
+                for conn, result in zip(conns, executor.map(lambda c: _safe(touch, c), conns)):
+                    if result is not None:
+                        logger.debug("Upstream warm-up failed: %s", result)
+                        conn.close()
+        finally:
+            for conn in conns:
+                pool._put_conn(conn)
+        return len(conns)
+
+    async def prewarm(self, count: int = UPSTREAM_PREWARM) -> int:
+        """Open count pooled connections before the first request needs them."""
+        if count <= 0:
+            return 0
+        return await asyncio.to_thread(self._warm, count, False)
+
+    async def keepalive(self, interval: float = UPSTREAM_KEEPALIVE_INTERVAL, count: int = UPSTREAM_PREWARM):
+        """
+        Background loop: when no request has gone upstream for a whole
+        interval, reconnect dropped connections and ping the rest.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            if time.monotonic() - self._last_request < interval:
+                continue
+            try:
+                await asyncio.to_thread(self._warm, count, True)
+                metrics.inc("upstream.keepalive_pings")
+            except Exception as e:
+                logger.warning("Upstream keep-alive failed: %s", e)
+
+    def stats(self) -> dict:
+        requests_sent = metrics.counter("upstream.requests")
+        warmed = metrics.counter("upstream.connections_warmed")
+        # Connections opened on the request path, not by prewarm/keep-alive
+        cold = metrics.counter("upstream.connections_opened") - warmed
+        return {
+            "pool_size": self.pool_size,
+            "circuit": self.circuit_state(),
+            "requests": requests_sent,
+            "connections_warmed": warmed,
+            "connections_cold": cold,
+            # Share of requests that found a ready connection in the pool
+            "reuse_ratio": round(max(0.0, 1 - cold / requests_sent), 3) if requests_sent else None,
+        }
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        self._session.close()
+
+
+def _safe(fn, arg):
+    try:
+        fn(arg)
+    except Exception as e:
+        return e
+    return None
@@ -0,0 +1,189 @@
+import asyncio
+import datetime
+import logging
+import os
+import threading
+
+from db import get_engine
+from settings import parse_pairs
+
+logger = logging.getLogger(__name__)
+
+# Budget settings are read from the environment in UsageTracker.load(), after
+# the app factory has loaded .env:
+#   DAILY_TOKEN_BUDGET      daily token budget per user, 0 disables enforcement
+#   TOKEN_BUDGET_OVERRIDES  per-user overrides, e.g. "alice:200000,loadtest:0"
+#   USAGE_FLUSH_INTERVAL    seconds between batched writes to SQLite (and
+#                           re-reads of every worker's totals)
+
+
+def _today() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).date().isoformat()
+
+
+def estimate_tokens(messages) -> int:
+    """
+    Rough token estimate for a list of chat messages (about 4 characters per token).
+    Used for the pre-call budget check and when the upstream omits usage fields.
+    """
+    return sum(len(m.content) for m in messages) // 4 + 1
+
+
+def usage_from_response(data: dict):
+    """
+    Pull (prompt_tokens, completion_tokens) out of a Llama API response.
+
+    The Llama API reports usage as a list of metrics; OpenAI-compatible
+    responses use a "usage" object. Returns None if neither is present.
+    """
+    metrics = {m.get("metric"): m.get("value") for m in data.get("metrics") or []}
+    if "num_prompt_tokens" in metrics:
+        return int(metrics["num_prompt_tokens"]), int(metrics.get("num_completion_tokens") or 0)
+
+    usage = data.get("usage") or {}
+    if "prompt_tokens" in usage:
+        return int(usage["prompt_tokens"]), int(usage.get("completion_tokens") or 0)
+    return None
+
+
+class UsageTracker:
+    """
+    Aggregates token usage per user in memory and flushes it to SQLite in batches.
+
+    Budget checks and recording on the /chat path never touch the database.
+    Instead, today's totals are read from the table at startup and again
+    after every flush, so they include what other workers have flushed and
+    a budget is shared by all workers. A user can still overspend by what
+    the other workers record before their next flush (at most one
+    flush_interval of usage each).
+    """
+
+    def __init__(self, daily_budget: int = 0, overrides: dict = None, flush_interval: float = 30):
+        self.daily_budget = daily_budget
+        self.overrides = overrides or {}
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._day = _today()
+        self._totals = {}   # username -> tokens used today (flushed + pending)
+        self._pending = {}  # (username, day) -> [prompt, completion, requests]
+
+    def budget_for(self, username: str) -> int:
+        return self.overrides.get(username, self.daily_budget)
+
+    def _roll_day(self):
+        day = _today()
+        if day != self._day:
+            self._day = day
+            self._totals = {}
+
+    def used_today(self, username: str) -> int:
+        with self._lock:
+            self._roll_day()
+            return self._totals.get(username, 0)
+
+    def within_budget(self, username: str, estimated_tokens: int = 0) -> bool:
+        """Check whether the user can spend estimated_tokens more today."""
+        budget = self.budget_for(username)
+        if budget <= 0:
+            return True
+        return self.used_today(username) + estimated_tokens <= budget
+
+    def record(self, username: str, prompt_tokens: int, completion_tokens: int):
+        with self._lock:
+            self._roll_day()
+            self._totals[username] = self._totals.get(username, 0) + prompt_tokens + completion_tokens
+            entry = self._pending.setdefault((username, self._day), [0, 0, 0])
+            entry[0] += prompt_tokens
+            entry[1] += completion_tokens
+            entry[2] += 1
+
+    def load(self):
+        """
+        Read budget settings from the environment and seed today's totals
+        from the database. Call once at startup.
+        """
+        self.daily_budget = int(os.getenv("DAILY_TOKEN_BUDGET", str(self.daily_budget)))
+        self.overrides = parse_pairs(os.getenv("TOKEN_BUDGET_OVERRIDES", ""), int)
+        self.flush_interval = float(os.getenv("USAGE_FLUSH_INTERVAL", str(self.flush_interval)))
+        self._refresh()
+
+    def _refresh(self):
+        # Today's flushed totals from every worker, plus what this worker has
+        # recorded but not flushed yet
+        from sqlmodel import Session, select
+        from models import TokenUsage
+
+        day = _today()
+        with Session(get_engine()) as session:
+            rows = session.exec(select(TokenUsage).where(TokenUsage.day == day)).all()
+        with self._lock:
+            self._roll_day()
+            if day != self._day:
+                return
+            totals = {row.username: row.prompt_tokens + row.completion_tokens for row in rows}
+            for (username, pending_day), (prompt, completion, _) in self._pending.items():
+                if pending_day == day:
+                    totals[username] = totals.get(username, 0) + prompt + completion
+            self._totals = totals
+
+    def flush(self) -> int:
+        """
+        Write all pending usage in one transaction, then re-read today's
+        totals. Returns the number of rows upserted.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if pending:
+            self._write(pending)
+        self._refresh()
+        return len(pending)
+
+    def _write(self, pending: dict):
+        from sqlalchemy.dialects.sqlite import insert
+        from sqlmodel import Session
+        from models import TokenUsage
+
+        rows = [
+            {
+                "username": username,
+                "day": day,
+                "prompt_tokens": prompt,
+                "completion_tokens": completion,
+                "requests": count,
+            }
+            for (username, day), (prompt, completion, count) in pending.items()
+        ]
+        stmt = insert(TokenUsage).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["username", "day"],
+            set_={
+                "prompt_tokens": TokenUsage.prompt_tokens + stmt.excluded.prompt_tokens,
+                "completion_tokens": TokenUsage.completion_tokens + stmt.excluded.completion_tokens,
+                "requests": TokenUsage.requests + stmt.excluded.requests,
+            },
+        )
+        try:
+            with Session(get_engine()) as session:
+                session.execute(stmt)
+                session.commit()
+        except Exception:
+            # Put the batch back so it is retried on the next flush
+            with self._lock:
+                for key, (prompt, completion, count) in pending.items():
+                    entry = self._pending.setdefault(key, [0, 0, 0])
+                    entry[0] += prompt
+                    entry[1] += completion
+                    entry[2] += count
+            raise
+
+    async def run(self):
+        """Background loop that flushes pending usage every flush_interval seconds."""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await asyncio.to_thread(self.flush)
+            except Exception as e:
+                logger.warning("Usage flush failed: %s", e)
+
+
+usage_tracker = UsageTracker()
@@ -0,0 +1,42 @@
+import collections
+import os
+import threading
+
+# Recently confirmed taken usernames kept exactly
+USERNAME_CACHE_SIZE = int(os.getenv("USERNAME_CACHE_SIZE", "10000"))
+
+
+class UsernameCache:
+    """
+    Usernames this worker has recently seen taken.
+
+    A small LRU of names confirmed taken (created here, or refused by the
+    unique index), so repeated signups for the same name are turned away
+    without hashing a password or touching the database. It can be stale
+    when another worker creates users; the unique index stays the
+    authority and a conflicting insert simply records the name here.
+    """
+
+    def __init__(self, cache_size: int = USERNAME_CACHE_SIZE):
+        self._taken = collections.OrderedDict()
+        self._cache_size = cache_size
+        self._lock = threading.Lock()
+
+    def known_taken(self, username: str) -> bool:
+        """True only if the name is certainly taken; False means "try the insert"."""
+        with self._lock:
+            if username in self._taken:
+                self._taken.move_to_end(username)
+                return True
+        return False
+
+    def taken(self, username: str):
+        """Record a username as taken (created here, or found by a conflict)."""
+        with self._lock:
+            self._taken[username] = None
+            self._taken.move_to_end(username)
+            if len(self._taken) > self._cache_size:
+                self._taken.popitem(last=False)
+
+
+usernames = UsernameCache()
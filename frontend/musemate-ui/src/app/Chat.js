@@ -1,10 +1,31 @@
 "use client";
-import { useState } from "react";
+import { useEffect, useRef, useState } from "react";
 
 export default function Chat() {
   const [userInput, setUserInput] = useState("");
   const [chatLog, setChatLog] = useState([]);
   const [isLoading, setIsLoading] = useState(false);
+  // Idempotency-Key of the message in the input box. Kept across double
+  // clicks and resends after an error so the server answers it only once;
+  // a new one is made when the text changes or after a successful reply.
+  const pendingKey = useRef(null);
+
+  // Restore the most recent messages saved on the server
+  useEffect(() => {
+    const token = localStorage.getItem("token");
+    if (!token) return;
+
+    fetch("http://localhost:8000/history?limit=50", {
+      headers: { "Authorization": `Bearer ${token}` }
+    })
+      .then((response) => (response.ok ? response.json() : null))
+      .then((data) => {
+        if (!data) return;
+        // The API returns newest first
+        setChatLog(data.messages.reverse().map(({ role, content }) => ({ role, content })));
+      })
+      .catch((error) => console.error("History error:", error));
+  }, []);
 
   async function sendMessage() {
     if (!userInput.trim()) return;
@@ -16,13 +37,19 @@ export default function Chat() {
       return;
     }
 
+    if (!pendingKey.current) {
+      pendingKey.current = crypto.randomUUID();
+    }
+    const idempotencyKey = pendingKey.current;
+
     setIsLoading(true);
     try {
       const response = await fetch("http://localhost:8000/chat", {
         method: "POST",
         headers: {
           "Content-Type": "application/json",
-          "Authorization": `Bearer ${token}`
+          "Authorization": `Bearer ${token}`,
+          "Idempotency-Key": idempotencyKey
         },
         body: JSON.stringify({ content: userInput })
       });
@@ -33,7 +60,12 @@ export default function Chat() {
         return;
       }
 
+      if (!response.ok) {
+        throw new Error(`Chat failed with status ${response.status}`);
+      }
+
       const data = await response.json();
+      pendingKey.current = null;
       setChatLog((prev) => [...prev, 
         { role: "user", content: userInput },
         { role: "assistant", content: data.reply }
@@ -61,7 +93,10 @@ export default function Chat() {
         <input
           type="text"
           value={userInput}
-          onChange={(e) => setUserInput(e.target.value)}
+          onChange={(e) => {
+            pendingKey.current = null;
+            setUserInput(e.target.value);
+          }}
           onKeyDown={(e) => e.key === "Enter" && !isLoading && sendMessage()}
           placeholder="Type your message..."
           disabled={isLoading}